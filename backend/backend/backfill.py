@@ -0,0 +1,282 @@
+"""
+Re-analysis backfill job.
+
+Finds memories whose combined description is missing, failed, or was generated by an
+older ANALYSIS_VERSION of the prompts, and regenerates them with a pool of workers under
+a rate limit. Memories that predate the related-memories graph are linked into it.
+Progress is checkpointed to a JSON file, so an interrupted run picks up where it stopped
+when started again with the same checkpoint.
+
+Regenerating a description also replaces the memory's facts. A running API server keeps
+the search index, related graph and fact table it loaded at startup, so restart it after
+a backfill; until then it drops its fact table when a survey touches a deleted fact.
+
+Usage (from backend/backend, with the same .env as the API):
+    python backfill.py --dry-run
+    python backfill.py --workers 4 --rate 2
+    python backfill.py --include-facts --checkpoint backfill_checkpoint.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+
+import main
+
+DEFAULT_CHECKPOINT = "backfill_checkpoint.json"
+
+
+def needs_reanalysis(mem: dict, include_facts: bool = False) -> Optional[str]:
+    """
+    Why a memory should be reprocessed: "missing", "failed", "outdated", "unlinked" for a
+    current memory with no related-memories list, or with include_facts "facts_missing" /
+    "facts_failed" for memories whose fact extraction never succeeded. None if it is up to date.
+    """
+    if not mem.get("combined_description"):
+        return "missing"
+    if mem.get("analysis_status") == "failed":
+        return "failed"
+    if not main.has_current_analysis(mem):
+        return "outdated"
+    if "related" not in mem:
+        return "unlinked"
+    if include_facts and main.GEMINI_KEY and mem.get("facts_status") != "complete":
+        return "facts_failed" if mem.get("facts_status") == "failed" else "facts_missing"
+    return None
+
+
+FACT_REASONS = ("facts_missing", "facts_failed")
+
+
+def checkpoint_key(doc_id: str, reason: str) -> str:
+    """Fact-only re-extraction and linking are tracked separately from regenerating the description."""
+    if reason in FACT_REASONS:
+        return f"{doc_id}:facts"
+    if reason == "unlinked":
+        return f"{doc_id}:related"
+    return doc_id
+
+
+class Checkpoint:
+    """
+    Keys already reprocessed (and failures with their errors) for one ANALYSIS_VERSION,
+    saved atomically to a JSON file. A checkpoint from another version is discarded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed = set()
+        self.failed: Dict[str, str] = {}
+        if path and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                state = json.load(checkpoint_file)
+            if state.get("analysis_version") == main.ANALYSIS_VERSION:
+                self.completed = set(state.get("completed", []))
+                self.failed = dict(state.get("failed", {}))
+            else:
+                print(f"Ignoring checkpoint for analysis version {state.get('analysis_version')}")
+
+    def mark_completed(self, key: str):
+        self.completed.add(key)
+        self.failed.pop(key, None)
+
+    def mark_failed(self, key: str, error: str):
+        self.failed[key] = error
+
+    def save(self):
+        if not self.path:
+            return
+        state = {
+            "analysis_version": main.ANALYSIS_VERSION,
+            "updated_at": datetime.utcnow().isoformat() + "Z",
+            "completed": sorted(self.completed),
+            "failed": self.failed,
+        }
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as checkpoint_file:
+            json.dump(state, checkpoint_file, indent=2)
+        os.replace(temporary_path, self.path)
+
+
+class RateLimiter:
+    """Spaces out acquisitions so at most `rate` happen per second (no limit if rate <= 0)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def find_backfill_candidates(include_facts: bool = False):
+    """Stream the media collection once and return (doc_id, mem, reason) for stale memories."""
+    candidates = []
+    for doc in main.db.collection("media").stream():
+        mem = doc.to_dict()
+        if not mem:
+            continue
+        reason = needs_reanalysis(mem, include_facts)
+        if reason:
+            candidates.append((doc.id, mem, reason))
+    return candidates
+
+
+async def reprocess_memory(doc_id: str, mem: dict, reason: str) -> Optional[str]:
+    """Regenerate one memory's description (or only its facts). Returns an error, or None on success."""
+    doc_ref = main.db.collection("media").document(doc_id)
+    caption = mem.get("caption", "") or mem.get("context", "")
+
+    if reason == "unlinked":
+        linked = await asyncio.to_thread(main.link_related_memories, doc_id)
+        return None if linked else "linking related memories failed"
+
+    if reason in FACT_REASONS:
+        await main.update_memory_facts(doc_id, doc_ref, mem["combined_description"])
+        facts_status = doc_ref.get().to_dict().get("facts_status")
+        return None if facts_status == "complete" else "fact extraction failed"
+
+    analysis = await main.generate_combined_description(caption, mem.get("url", ""), doc_id, doc_ref, mem.get("filename"))
+    if analysis["analysis_status"] == "failed":
+        return "image analysis returned no description"
+    return None
+
+
+async def run_backfill(candidates, checkpoint: Checkpoint, workers: int, rate: float, retry_failed: bool = True,
+                       limit: Optional[int] = None, checkpoint_every: int = 10, progress_interval: float = 10.0) -> dict:
+    """
+    Reprocess candidates with `workers` concurrent workers, starting at most `rate` per second,
+    skipping memories the checkpoint already records. Returns a summary of the run.
+    """
+    pending = [
+        (doc_id, mem, reason) for doc_id, mem, reason in candidates
+        if checkpoint_key(doc_id, reason) not in checkpoint.completed
+        and (retry_failed or checkpoint_key(doc_id, reason) not in checkpoint.failed)
+    ]
+    skipped = len(candidates) - len(pending)
+    if limit is not None:
+        pending = pending[:limit]
+    if skipped:
+        print(f"Skipping {skipped} memories already recorded in {checkpoint.path}")
+
+    queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+    limiter = RateLimiter(rate)
+    stats = Counter()
+    errors = Counter()
+    started = time.perf_counter()
+
+    def report_progress():
+        elapsed = time.perf_counter() - started
+        done = stats["succeeded"] + stats["failed"]
+        print(f"Progress: {done}/{len(pending)} processed, {stats['failed']} failed, "
+              f"{done / elapsed if elapsed else 0.0:.2f} memories/s")
+
+    async def worker():
+        while True:
+            try:
+                doc_id, mem, reason = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await limiter.acquire()
+            try:
+                error = await reprocess_memory(doc_id, mem, reason)
+            except Exception as e:
+                traceback.print_exc()
+                error = str(e) or type(e).__name__
+
+            if error:
+                stats["failed"] += 1
+                errors[error] += 1
+                checkpoint.mark_failed(checkpoint_key(doc_id, reason), error)
+                print(f"Failed to reprocess {doc_id} ({reason}): {error}")
+            else:
+                stats["succeeded"] += 1
+                checkpoint.mark_completed(checkpoint_key(doc_id, reason))
+            if (stats["succeeded"] + stats["failed"]) % checkpoint_every == 0:
+                checkpoint.save()
+
+    async def progress():
+        while True:
+            await asyncio.sleep(progress_interval)
+            report_progress()
+
+    reporter = asyncio.ensure_future(progress())
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+    finally:
+        reporter.cancel()
+        checkpoint.save()
+
+    elapsed = time.perf_counter() - started
+    processed = stats["succeeded"] + stats["failed"]
+    return {
+        "candidates": len(candidates),
+        "skipped": skipped,
+        "processed": processed,
+        "succeeded": stats["succeeded"],
+        "failed": stats["failed"],
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_per_second": round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+        "errors": dict(errors.most_common()),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Regenerate missing, failed or outdated memory descriptions.")
+    parser.add_argument("--workers", type=int, default=4, help="Memories processed concurrently")
+    parser.add_argument("--rate", type=float, default=2.0,
+                        help="Maximum memories started per second (0 for no limit)")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT,
+                        help="JSON file recording progress, used to resume an interrupted run")
+    parser.add_argument("--checkpoint-every", type=int, default=10,
+                        help="Save the checkpoint after this many processed memories")
+    parser.add_argument("--skip-failed", action="store_true",
+                        help="Don't retry memories that failed in a previous run")
+    parser.add_argument("--include-facts", action="store_true",
+                        help="Also re-extract facts for memories whose fact extraction is missing or failed")
+    parser.add_argument("--limit", type=int, help="Process at most this many memories")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be reprocessed")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    if not main.GEMINI_KEY:
+        print("Warning: GEMINI_KEY is not set; descriptions will fall back to captions")
+
+    candidates = find_backfill_candidates(include_facts=args.include_facts)
+    reasons = Counter(reason for _, _, reason in candidates)
+    print(f"Found {len(candidates)} memories to reprocess (analysis version {main.ANALYSIS_VERSION}): "
+          + (", ".join(f"{reason}={count}" for reason, count in sorted(reasons.items())) or "none"))
+    if args.dry_run or not candidates:
+        return
+
+    checkpoint = Checkpoint(args.checkpoint)
+    summary = asyncio.run(run_backfill(
+        candidates, checkpoint, args.workers, args.rate,
+        retry_failed=not args.skip_failed, limit=args.limit, checkpoint_every=max(1, args.checkpoint_every),
+    ))
+    print(f"Backfill finished: {summary['succeeded']} succeeded, {summary['failed']} failed, "
+          f"{summary['skipped']} skipped in {summary['elapsed_seconds']}s "
+          f"({summary['throughput_per_second']} memories/s)")
+    for error, count in summary["errors"].items():
+        print(f"  {count} x {error}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1 @@
+"""Offline benchmarks for the Rememb-AR API using in-process fakes (see benchmarks/run.py)."""
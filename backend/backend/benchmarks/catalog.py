@@ -0,0 +1,130 @@
+"""
+Synthetic memory catalogs for benchmarks.
+
+Captions are assembled from small vocabularies of people, pets, places, cars and events,
+so full-text search, related-memory links and fact-based surveys all see realistic overlap.
+Each memory carries the facts a model would extract from its caption.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from .fakes import FAKE_STORAGE_HOST, FAKE_VISUAL_DESCRIPTION
+
+NAMES = ["Susan", "Anna", "Robert", "James", "Maria", "Linda", "David", "Helen", "George", "Ruth"]
+RELATIVES = ["sister", "brother", "daughter", "son", "grandson", "granddaughter", "cousin", "niece"]
+PETS = [("dog", ["Beagle", "Golden Retriever", "Poodle", "Collie"]), ("cat", ["Siamese", "Persian", "Tabby"])]
+PET_NAMES = ["Max", "Bella", "Charlie", "Lucy", "Buddy", "Daisy"]
+PLACES = ["Paris", "Rome", "Hawaii", "the Grand Canyon", "London", "Lake Tahoe", "Florida"]
+TRIPS = ["vacation", "honeymoon", "anniversary trip", "road trip"]
+CAR_BRANDS = ["Ford", "Toyota", "Chevrolet", "Honda", "Buick"]
+COLORS = ["red", "blue", "green", "white", "black"]
+EVENTS = ["wedding", "graduation", "retirement party", "birthday party"]
+
+
+def _relative_memory(rng: random.Random) -> Tuple[str, List[dict]]:
+    relative, name, place = rng.choice(RELATIVES), rng.choice(NAMES), rng.choice(PLACES)
+    caption = f"My {relative} {name} visiting me, we talked about our time in {place}"
+    return caption, [{"subject": relative, "relation": "name", "value": name, "category": "people"}]
+
+
+def _pet_memory(rng: random.Random) -> Tuple[str, List[dict]]:
+    (pet, breeds), name = rng.choice(PETS), rng.choice(PET_NAMES)
+    breed = rng.choice(breeds)
+    caption = f"Our {pet} {name}, a {breed}, playing in the backyard"
+    return caption, [
+        {"subject": pet, "relation": "name", "value": name, "category": "objects"},
+        {"subject": pet, "relation": "breed", "value": breed, "category": "objects"},
+    ]
+
+
+def _trip_memory(rng: random.Random) -> Tuple[str, List[dict]]:
+    trip, place, name = rng.choice(TRIPS), rng.choice(PLACES), rng.choice(NAMES)
+    caption = f"Our {trip} to {place} with {name}"
+    return caption, [{"subject": trip, "relation": "place", "value": place, "category": "places"}]
+
+
+def _car_memory(rng: random.Random) -> Tuple[str, List[dict]]:
+    brand, color = rng.choice(CAR_BRANDS), rng.choice(COLORS)
+    caption = f"Driving my {color} {brand} car along the coast"
+    return caption, [
+        {"subject": "car", "relation": "brand", "value": brand, "category": "objects"},
+        {"subject": "car", "relation": "color", "value": color.capitalize(), "category": "objects"},
+    ]
+
+
+def _event_memory(rng: random.Random) -> Tuple[str, List[dict]]:
+    event, name, year = rng.choice(EVENTS), rng.choice(NAMES), rng.randint(1960, 2020)
+    caption = f"{name}'s {event} in {year}, the whole family was there"
+    return caption, [{"subject": event, "relation": "year", "value": str(year), "category": "events"}]
+
+
+MEMORY_KINDS = [_relative_memory, _pet_memory, _trip_memory, _car_memory, _event_memory]
+RELATED_NEIGHBORS = 10
+
+
+def _link_catalog(rng: random.Random, media: List[Tuple[str, dict]], kinds: List[int]):
+    """
+    Give every memory a persisted `related` list drawn from memories of the same kind, as
+    the backfill job would leave it. Scores are synthetic; only the shape matters here.
+    """
+    by_kind: Dict[int, List[str]] = {}
+    for (doc_id, _), kind in zip(media, kinds):
+        by_kind.setdefault(kind, []).append(doc_id)
+    for (doc_id, data), kind in zip(media, kinds):
+        peers = by_kind[kind]
+        others = [other for other in rng.sample(peers, min(RELATED_NEIGHBORS + 1, len(peers))) if other != doc_id]
+        scores = sorted((round(rng.uniform(0.2, 0.9), 4) for _ in others), reverse=True)
+        data["related"] = [{"id": other, "score": score} for other, score in zip(others[:RELATED_NEIGHBORS], scores)]
+
+
+def generate_catalog(size: int, seed: int = 0, described_fraction: float = 1.0,
+                     with_facts: bool = True, analysis_version: int = 1, linked: bool = True) -> Tuple[List[Tuple[str, dict]], List[Tuple[str, dict]], Dict[str, list]]:
+    """
+    Build a synthetic catalog of `size` memories.
+
+    Returns (media, facts, facts_by_caption):
+    - media: (doc_id, data) pairs for the "media" collection; only `described_fraction`
+      of them already have a combined description at `analysis_version` (the rest are
+      analyzed lazily)
+    - facts: (fact_id, data) pairs for the "facts" collection, for described memories
+      when `with_facts` is set
+    - facts_by_caption: what the fake model should "extract" for each caption
+
+    With `linked`, memories also carry `related` lists, as after a backfill run.
+    """
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    media, facts, facts_by_caption = [], [], {}
+    kinds = []
+
+    for index in range(size):
+        kind = rng.randrange(len(MEMORY_KINDS))
+        kinds.append(kind)
+        caption, memory_facts = MEMORY_KINDS[kind](rng)
+        doc_id = f"memory-{index:06d}"
+        filename = f"{doc_id}.jpg"
+        data = {
+            "filename": filename,
+            "url": f"{FAKE_STORAGE_HOST}/{filename}",
+            "caption": caption,
+            "weight": round(rng.uniform(0.5, 3.0), 2),
+            "uploaded_at": (start + timedelta(minutes=index)).isoformat() + "Z",
+        }
+        facts_by_caption[caption] = memory_facts
+
+        if rng.random() < described_fraction:
+            data["combined_description"] = f"{caption}. {FAKE_VISUAL_DESCRIPTION}"
+            data["analysis_status"] = "complete"
+            data["analysis_version"] = analysis_version
+            if with_facts:
+                for fact_index, fact in enumerate(memory_facts):
+                    facts.append((f"{doc_id}_{fact_index}", dict(fact, memory_id=doc_id, last_asked_at=None)))
+                data["facts_status"] = "complete"
+                data["fact_count"] = len(memory_facts)
+
+        media.append((doc_id, data))
+
+    if linked:
+        _link_catalog(rng, media, kinds)
+    return media, facts, facts_by_caption
@@ -0,0 +1,358 @@
+"""
+In-process fakes for Firestore, Cloud Storage, image downloads and the Gemini model.
+
+Every fake routes its external calls through a ServiceProfile, which counts calls,
+sleeps for the configured latency and raises ServiceUnavailable at the configured
+failure rate, so benchmarks can measure both speed and call volume per endpoint.
+"""
+import hashlib
+import io
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import types
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+
+from google.api_core.exceptions import NotFound, ServiceUnavailable
+from PIL import Image
+
+
+class CallCounter:
+    """Thread-safe counter of external calls, keyed by "service.operation"."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def add(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+class ServiceProfile:
+    """Latency (seconds, with +/- jitter fraction) and failure injection for one fake service."""
+
+    def __init__(self, name: str, counter: CallCounter, latency: float = 0.0, jitter: float = 0.2,
+                 failure_rate: float = 0.0, seed: Optional[int] = None):
+        self.name = name
+        self.counter = counter
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def call(self, operation: str, extra_latency: float = 0.0):
+        """Record one round trip, simulate its latency and possibly fail it."""
+        self.counter.add(f"{self.name}.{operation}")
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter, self.jitter)
+            fail = self._random.random() < self.failure_rate
+        delay = self.latency * (1 + jitter) + extra_latency
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise ServiceUnavailable(f"Injected {self.name} failure during {operation}")
+
+
+# --- Firestore ---
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data: Optional[dict]):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[dict]:
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, doc_id: str):
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self):
+        self._collection.profile.call("get")
+        return FakeDocumentSnapshot(self, self._collection._read(self.id))
+
+    def update(self, fields: dict):
+        self._collection.profile.call("write")
+        self._collection._update(self.id, fields)
+
+    def set(self, data: dict, merge: bool = False):
+        self._collection.profile.call("write")
+        self._collection._set(self.id, data, merge)
+
+    def delete(self):
+        self._collection.profile.call("write")
+        self._collection._delete(self.id)
+
+
+class FakeCollection:
+    def __init__(self, name: str, profile: ServiceProfile, per_document_latency: float):
+        self.name = name
+        self.profile = profile
+        self.per_document_latency = per_document_latency
+        self._lock = threading.Lock()
+        self._documents: Dict[str, dict] = {}
+        self._ids = itertools.count(1)
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def stream(self):
+        with self._lock:
+            documents = list(self._documents.items())
+        self.profile.call("stream", extra_latency=self.per_document_latency * len(documents))
+        self.profile.counter.add("firestore.documents_read", len(documents))
+        return iter([
+            FakeDocumentSnapshot(FakeDocumentReference(self, doc_id), data)
+            for doc_id, data in documents
+        ])
+
+    def add(self, data: dict):
+        self.profile.call("write")
+        reference = self.document()
+        self._set(reference.id, data, merge=False)
+        return datetime.utcnow(), reference
+
+    def document(self, doc_id: Optional[str] = None):
+        if doc_id is None:
+            doc_id = f"{self.name}-{next(self._ids):08d}"
+        return FakeDocumentReference(self, doc_id)
+
+    def seed(self, doc_id: str, data: dict):
+        """Insert a document directly, without simulating a round trip."""
+        with self._lock:
+            self._documents[doc_id] = dict(data)
+
+    def _read(self, doc_id: str) -> Optional[dict]:
+        with self._lock:
+            data = self._documents.get(doc_id)
+            return dict(data) if data is not None else None
+
+    def _update(self, doc_id: str, fields: dict):
+        with self._lock:
+            if doc_id not in self._documents:
+                raise NotFound(f"No document to update: {self.name}/{doc_id}")
+            self._documents[doc_id].update(fields)
+
+    def _set(self, doc_id: str, data: dict, merge: bool):
+        with self._lock:
+            if merge and doc_id in self._documents:
+                self._documents[doc_id].update(data)
+            else:
+                self._documents[doc_id] = dict(data)
+
+    def _delete(self, doc_id: str):
+        with self._lock:
+            self._documents.pop(doc_id, None)
+
+
+class FakeWriteBatch:
+    def __init__(self, profile: ServiceProfile):
+        self._profile = profile
+        self._writes = []
+
+    def update(self, reference, fields: dict):
+        self._writes.append(lambda: reference._collection._update(reference.id, fields))
+
+    def set(self, reference, data: dict, merge: bool = False):
+        self._writes.append(lambda: reference._collection._set(reference.id, data, merge))
+
+    def delete(self, reference):
+        self._writes.append(lambda: reference._collection._delete(reference.id))
+
+    def commit(self):
+        self._profile.call("commit")
+        self._profile.counter.add("firestore.batched_writes", len(self._writes))
+        for write in self._writes:
+            write()
+        self._writes = []
+
+
+class FakeFirestore:
+    """Stands in for firestore.client(): collections, document references and write batches."""
+
+    def __init__(self, profile: ServiceProfile, per_document_latency: float = 0.0):
+        self.profile = profile
+        self.per_document_latency = per_document_latency
+        self._collections: Dict[str, FakeCollection] = {}
+        self._lock = threading.Lock()
+
+    def collection(self, name: str) -> FakeCollection:
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = FakeCollection(name, self.profile, self.per_document_latency)
+            return self._collections[name]
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self.profile)
+
+    def clear(self):
+        with self._lock:
+            self._collections = {}
+
+
+# --- Cloud Storage and image downloads ---
+
+FAKE_STORAGE_HOST = "https://fake-storage.invalid"
+
+
+class FakeBlob:
+    def __init__(self, bucket, name: str):
+        self._bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, data, content_type: Optional[str] = None):
+        self._bucket.profile.call("upload")
+        self._bucket.profile.counter.add("storage.bytes_uploaded", len(data))
+        with self._bucket._lock:
+            self._bucket._blobs[self.name] = bytes(data)
+
+    def generate_signed_url(self, version: str = "v4", expiration: int = 3600, **kwargs) -> str:
+        self._bucket.profile.call("sign")
+        return f"{FAKE_STORAGE_HOST}/{self.name}"
+
+
+class FakeBucket:
+    """Stands in for storage.bucket(); blobs live in memory."""
+
+    def __init__(self, profile: ServiceProfile):
+        self.profile = profile
+        self._lock = threading.Lock()
+        self._blobs: Dict[str, bytes] = {}
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def clear(self):
+        with self._lock:
+            self._blobs = {}
+
+
+def make_test_image(size: int = 32) -> bytes:
+    """A tiny PNG that PIL can open, used as the content of every fake image."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), color=(180, 120, 200)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FakeHTTP:
+    """Stands in for requests.get() when main downloads an image from a signed URL."""
+
+    def __init__(self, profile: ServiceProfile):
+        self.profile = profile
+        self._image = make_test_image()
+
+    def get(self, url: str, timeout: Optional[float] = None, **kwargs):
+        self.profile.call("download")
+        return types.SimpleNamespace(
+            content=self._image,
+            status_code=200,
+            raise_for_status=lambda: None,
+        )
+
+
+# --- Gemini ---
+
+FAKE_VISUAL_DESCRIPTION = "The photo shows smiling people outdoors on a sunny day."
+
+
+def _stable_score(*parts: str) -> float:
+    digest = hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+    return round(int(digest[:8], 16) / 0xFFFFFFFF, 2)
+
+
+class FakeGemini:
+    """
+    Shared backend for FakeGenerativeModel instances. Recognizes each prompt used by main
+    and returns a well-formed response; extracted facts come from the synthetic catalog.
+    """
+
+    def __init__(self, profile: ServiceProfile):
+        self.profile = profile
+        self.facts_by_caption: Dict[str, list] = {}
+
+    def model_class(self):
+        backend = self
+
+        class FakeGenerativeModel:
+            def __init__(self, model_name: str = "", **kwargs):
+                self.model_name = model_name
+
+            def generate_content(self, contents, **kwargs):
+                return types.SimpleNamespace(text=backend.respond(contents))
+
+        return FakeGenerativeModel
+
+    def respond(self, contents) -> str:
+        if isinstance(contents, (list, tuple)):
+            self.profile.call("vision")
+            return FAKE_VISUAL_DESCRIPTION
+
+        prompt = str(contents)
+        if prompt.startswith("Combine these two descriptions"):
+            self.profile.call("combine")
+            caption = prompt.split("User Context (PRIMARY - prioritize this):\n", 1)[1].split("\n", 1)[0]
+            return f"{caption}. {FAKE_VISUAL_DESCRIPTION}"
+
+        if prompt.startswith("Extract general facts"):
+            self.profile.call("extract_facts")
+            description = prompt.split("Memory description:\n", 1)[1].split("\n\nRules:", 1)[0]
+            caption = description.split(f". {FAKE_VISUAL_DESCRIPTION}", 1)[0]
+            return json.dumps(self.facts_by_caption.get(caption, []))
+
+        if prompt.startswith("You are creating a memory recall survey"):
+            self.profile.call("survey")
+            memory_ids = re.findall(r"\(ID: ([^)]+)\)", prompt) or [""]
+            return json.dumps([
+                {
+                    "question": question,
+                    "type": "multiple_choice",
+                    "options": options,
+                    "correct_answer": options[0],
+                    "related_memory_ids": [memory_ids[index % len(memory_ids)]],
+                    "difficulty": "easy",
+                    "category": category,
+                }
+                for index, (question, options, category) in enumerate([
+                    ("What breed is your dog?", ["Beagle", "Poodle", "Boxer", "Collie"], "objects"),
+                    ("What is your sister's name?", ["Susan", "Sarah", "Emily", "Jessica"], "people"),
+                    ("Where did you go on vacation?", ["Paris", "Rome", "Hawaii", "London"], "places"),
+                ])
+            ])
+
+        if prompt.startswith("You are analyzing memory-related queries"):
+            self.profile.call("similarity")
+            context = prompt.split("Image Context", 1)[-1][:200]
+            queries = re.findall(r"^Query (\d+): (.*)$", prompt, re.MULTILINE)
+            if queries:
+                return "\n".join(
+                    f"Score {number}: {_stable_score(query, context)}\nReasoning {number}: Synthetic benchmark score."
+                    for number, query in queries
+                )
+            query = re.search(r"^Query: (.*)$", prompt, re.MULTILINE)
+            score = _stable_score(query.group(1) if query else "", context)
+            return f"Score: {score}\nReasoning: Synthetic benchmark score."
+
+        self.profile.call("other")
+        return ""
@@ -0,0 +1,108 @@
+"""
+Loads the FastAPI app from main.py wired to in-process fakes instead of live
+Firestore, Storage and Gemini, and resets its in-process state between runs.
+"""
+import importlib
+import os
+import sys
+from dataclasses import dataclass, field
+from typing import Optional
+
+import firebase_admin
+import google.generativeai as genai
+import requests
+from firebase_admin import credentials, firestore, storage
+
+from .catalog import generate_catalog
+from .fakes import CallCounter, FakeBucket, FakeFirestore, FakeGemini, FakeHTTP, ServiceProfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class FakeServices:
+    """
+    Latency (seconds) and failure rates for each fake external service. A service's
+    failure rate left as None falls back to `failure_rate`.
+    """
+    firestore_latency: float = 0.01
+    firestore_per_document_latency: float = 0.00001
+    storage_latency: float = 0.02
+    http_latency: float = 0.02
+    model_latency: float = 0.05
+    failure_rate: float = 0.0
+    firestore_failure_rate: Optional[float] = None
+    storage_failure_rate: Optional[float] = None
+    http_failure_rate: Optional[float] = None
+    model_failure_rate: Optional[float] = None
+    seed: int = 0
+    counter: CallCounter = field(default_factory=CallCounter)
+
+    def __post_init__(self):
+        def profile(name, latency, failure_rate, offset):
+            if failure_rate is None:
+                failure_rate = self.failure_rate
+            return ServiceProfile(name, self.counter, latency=latency,
+                                  failure_rate=failure_rate, seed=self.seed + offset)
+
+        self.db = FakeFirestore(profile("firestore", self.firestore_latency, self.firestore_failure_rate, 1),
+                                per_document_latency=self.firestore_per_document_latency)
+        self.bucket = FakeBucket(profile("storage", self.storage_latency, self.storage_failure_rate, 2))
+        self.http = FakeHTTP(profile("http", self.http_latency, self.http_failure_rate, 3))
+        self.gemini = FakeGemini(profile("gemini", self.model_latency, self.model_failure_rate, 4))
+
+
+def load_app(services: FakeServices):
+    """
+    Import main.py with Firebase, Gemini and image downloads patched to the given fakes.
+    Returns the imported module; its `app` attribute is the ASGI application.
+    """
+    os.environ["FIREBASE_KEY"] = "benchmark-fake-credentials"
+    os.environ["GEMINI_KEY"] = "benchmark-fake-key"
+
+    credentials.Certificate = lambda *args, **kwargs: None
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+    firestore.client = lambda *args, **kwargs: services.db
+    storage.bucket = lambda *args, **kwargs: services.bucket
+    genai.configure = lambda *args, **kwargs: None
+    genai.GenerativeModel = services.gemini.model_class()
+    requests.get = services.http.get
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    if "main" in sys.modules:
+        main = importlib.reload(sys.modules["main"])
+    else:
+        main = importlib.import_module("main")
+    main.GEMINI_KEY = os.environ["GEMINI_KEY"]
+    return main
+
+
+def reset_app_state(main):
+    """Drop every in-process index and cache so the next run starts cold."""
+    main.search_index = main.SearchIndex()
+    main.related_graph = main.RelatedGraph(max_neighbors=main.RELATED_MAX_NEIGHBORS)
+    main.fact_store = main.FactStore()
+    main._description_flights.clear()
+    main.prefetch_sessions.clear()
+    main._unsettled_shown.clear()
+    main._prefetch_loop = None
+
+
+def seed_catalog(services: FakeServices, size: int, seed: int = 0, described_fraction: float = 1.0,
+                 with_facts: bool = True, analysis_version: int = 1, linked: bool = True):
+    """Replace the fake database contents with a synthetic catalog of `size` memories."""
+    services.db.clear()
+    services.bucket.clear()
+    media, facts, facts_by_caption = generate_catalog(
+        size, seed=seed, described_fraction=described_fraction, with_facts=with_facts,
+        analysis_version=analysis_version, linked=linked
+    )
+    media_collection = services.db.collection("media")
+    for doc_id, data in media:
+        media_collection.seed(doc_id, data)
+    facts_collection = services.db.collection("facts")
+    for fact_id, data in facts:
+        facts_collection.seed(fact_id, data)
+    services.gemini.facts_by_caption = facts_by_caption
+    services.counter.reset()
@@ -0,0 +1,243 @@
+"""
+Offline benchmark and load-test runner.
+
+Runs concurrent request scenarios against the FastAPI app (in-process, over ASGI) with
+Firestore, Storage and Gemini replaced by latency-injecting fakes, for synthetic catalogs
+of increasing size. Reports p50/p95/p99 latency, throughput and external calls per request.
+
+Usage (from backend/backend):
+    python -m benchmarks.run --sizes 10 1000 100000 --concurrency 8 --requests 50
+    python -m benchmarks.run --scenarios random_memories search --model-latency 0.3 --failure-rate 0.01
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import random
+import sys
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from .catalog import NAMES, PETS, PLACES
+from .fakes import make_test_image
+from .harness import FakeServices, load_app, reset_app_state, seed_catalog
+
+SEARCH_TERMS = NAMES + PLACES + [pet for pet, _ in PETS] + ["car", "wedding", "vacation", "sister"]
+SIMILARITY_QUERIES = ["my sister", "our dog", "trips to Paris", "family wedding", "the old car"]
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    # Builds (path, httpx request kwargs) for the i-th request
+    build: Callable[[int, random.Random, int], Tuple[str, dict]]
+    # Issues model calls for every memory in the catalog, so only runs on small catalogs
+    per_memory_model_calls: bool = False
+
+
+def _random_memory_id(rng: random.Random, size: int) -> str:
+    return f"memory-{rng.randrange(max(size, 1)):06d}"
+
+
+SCENARIOS: Dict[str, Scenario] = {scenario.name: scenario for scenario in [
+    Scenario("random_memories", "GET",
+             lambda i, rng, size: ("/random_memories", {"params": {"k": 5}})),
+    Scenario("random_memories_session", "GET",
+             lambda i, rng, size: ("/random_memories", {"params": {"k": 1, "session_id": f"bench-{i % 4}"}})),
+    Scenario("random_memories_related", "GET",
+             lambda i, rng, size: ("/random_memories", {"params": {"k": 5, "related": "true"}})),
+    Scenario("search", "GET",
+             lambda i, rng, size: ("/search", {"params": {"q": rng.choice(SEARCH_TERMS), "limit": 20}})),
+    Scenario("related", "GET",
+             lambda i, rng, size: (f"/related/{_random_memory_id(rng, size)}", {"params": {"k": 5}})),
+    Scenario("generate_survey", "GET",
+             lambda i, rng, size: ("/generate_survey", {})),
+    Scenario("media_list", "GET",
+             lambda i, rng, size: ("/media_list", {})),
+    Scenario("upload_media", "POST",
+             lambda i, rng, size: ("/upload_media", {
+                 "files": {"file": (f"bench-{i}.png", make_test_image(), "image/png")},
+                 "data": {"caption": f"Our vacation to {rng.choice(PLACES)} with {rng.choice(NAMES)}"},
+             })),
+    Scenario("upload_media_bulk", "POST",
+             lambda i, rng, size: ("/upload_media_bulk", {
+                 "files": [("files", (f"bench-{i}-{n}.png", make_test_image(), "image/png")) for n in range(10)],
+                 "data": {"captions": [f"Our {rng.choice(PETS)[0]} at home with {rng.choice(NAMES)}" for _ in range(10)]},
+             })),
+    Scenario("update_weights_by_similarity", "POST",
+             lambda i, rng, size: ("/update_weights_by_similarity", {"json": {"query": rng.choice(SIMILARITY_QUERIES)}}),
+             per_memory_model_calls=True),
+    Scenario("update_weights_by_similarity_batch", "POST",
+             lambda i, rng, size: ("/update_weights_by_similarity_batch", {"json": {"queries": rng.sample(SIMILARITY_QUERIES, 3)}}),
+             per_memory_model_calls=True),
+]}
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def run_scenario(app, services: FakeServices, scenario: Scenario, catalog_size: int,
+                       total_requests: int, concurrency: int, warmup: int, seed: int) -> dict:
+    """Fire `total_requests` requests with at most `concurrency` in flight and summarize them."""
+    rng = random.Random(seed)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+
+        async def send(index: int) -> Tuple[float, Optional[int]]:
+            path, kwargs = scenario.build(index, rng, catalog_size)
+            started = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, path, **kwargs)
+                status = response.status_code
+            except Exception:
+                status = None
+            return time.perf_counter() - started, status
+
+        # Warmup requests build lazy indexes and are excluded from the statistics
+        for index in range(warmup):
+            await send(-1 - index)
+
+        before = services.counter.snapshot()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(index: int):
+            async with semaphore:
+                return await send(index)
+
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(limited(index) for index in range(total_requests)))
+        elapsed = time.perf_counter() - started
+        after = services.counter.snapshot()
+
+    latencies = sorted(latency for latency, _ in outcomes)
+    errors = sum(1 for _, status in outcomes if status is None or status >= 400)
+    calls = {
+        name: round((count - before.get(name, 0)) / total_requests, 2)
+        for name, count in sorted(after.items())
+        if count - before.get(name, 0)
+    }
+    return {
+        "scenario": scenario.name,
+        "catalog_size": catalog_size,
+        "requests": total_requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "throughput_rps": round(total_requests / elapsed, 2) if elapsed > 0 else 0.0,
+        "calls_per_request": calls,
+    }
+
+
+def print_report(results: List[dict]):
+    header = f"{'catalog':>8}  {'scenario':<36}{'reqs':>6}{'errs':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}  external calls / request"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        if result.get("skipped"):
+            print(f"{result['catalog_size']:>8}  {result['scenario']:<36}skipped: {result['skipped']}")
+            continue
+        calls = " ".join(f"{name}={count:g}" for name, count in result["calls_per_request"].items())
+        print(
+            f"{result['catalog_size']:>8}  {result['scenario']:<36}{result['requests']:>6}{result['errors']:>6}"
+            f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+            f"{result['throughput_rps']:>9.1f}  {calls}"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Rememb-AR endpoints against in-process fakes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000],
+                        help="Synthetic catalog sizes to benchmark (10 to 100000)")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=sorted(SCENARIOS),
+                        help="Scenarios to run")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per scenario")
+    parser.add_argument("--model-requests", type=int, default=3,
+                        help="Requests per scenario for scenarios that call the model once per memory")
+    parser.add_argument("--max-model-catalog", type=int, default=1000,
+                        help="Largest catalog on which per-memory model scenarios are run")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum requests in flight")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured requests before each scenario")
+    parser.add_argument("--described-fraction", type=float, default=1.0,
+                        help="Fraction of memories that already have a combined description")
+    parser.add_argument("--firestore-latency", type=float, default=0.01, help="Seconds per Firestore round trip")
+    parser.add_argument("--firestore-per-document-latency", type=float, default=0.00001,
+                        help="Extra seconds per document streamed")
+    parser.add_argument("--storage-latency", type=float, default=0.02, help="Seconds per Storage call")
+    parser.add_argument("--http-latency", type=float, default=0.02, help="Seconds per image download")
+    parser.add_argument("--model-latency", type=float, default=0.05, help="Seconds per Gemini call")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Probability that any external call fails with ServiceUnavailable")
+    parser.add_argument("--firestore-failure-rate", type=float,
+                        help="Failure probability for Firestore calls (default: --failure-rate)")
+    parser.add_argument("--storage-failure-rate", type=float,
+                        help="Failure probability for Storage calls (default: --failure-rate)")
+    parser.add_argument("--http-failure-rate", type=float,
+                        help="Failure probability for image downloads (default: --failure-rate)")
+    parser.add_argument("--model-failure-rate", type=float,
+                        help="Failure probability for Gemini calls (default: --failure-rate)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for catalogs and injection")
+    parser.add_argument("--app-logs", action="store_true", help="Show the app's own log output")
+    parser.add_argument("--json", dest="json_path", help="Also write results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    services = FakeServices(
+        firestore_latency=args.firestore_latency,
+        firestore_per_document_latency=args.firestore_per_document_latency,
+        storage_latency=args.storage_latency,
+        http_latency=args.http_latency,
+        model_latency=args.model_latency,
+        failure_rate=args.failure_rate,
+        firestore_failure_rate=args.firestore_failure_rate,
+        storage_failure_rate=args.storage_failure_rate,
+        http_failure_rate=args.http_failure_rate,
+        model_failure_rate=args.model_failure_rate,
+        seed=args.seed,
+    )
+    app_module = load_app(services)
+
+    results = []
+    for size in args.sizes:
+        for name in args.scenarios:
+            scenario = SCENARIOS[name]
+            if scenario.per_memory_model_calls and size > args.max_model_catalog:
+                results.append({"scenario": name, "catalog_size": size,
+                                "skipped": f"catalog larger than --max-model-catalog {args.max_model_catalog}"})
+                continue
+
+            seed_catalog(services, size, seed=args.seed, described_fraction=args.described_fraction,
+                         analysis_version=app_module.ANALYSIS_VERSION)
+            reset_app_state(app_module)
+            total_requests = args.model_requests if scenario.per_memory_model_calls else args.requests
+            print(f"Running {name} on {size} memories ({total_requests} requests)...", file=sys.stderr)
+            # main.py logs with print(); keep it out of the report unless asked for
+            app_output = contextlib.nullcontext() if args.app_logs else contextlib.redirect_stdout(io.StringIO())
+            with app_output:
+                results.append(asyncio.run(run_scenario(
+                    app_module.app, services, scenario, size, total_requests,
+                    args.concurrency, args.warmup, args.seed,
+                )))
+
+    print_report(results)
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import heapq
+import random
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+FACT_CATEGORIES = ("people", "places", "objects", "events")
+
+# Question templates keyed by relation; the extraction prompt is restricted to these relations
+RELATION_TEMPLATES = {
+    "name": "What is your {subject}'s name?",
+    "breed": "What breed is your {subject}?",
+    "brand": "What brand is your {subject}?",
+    "color": "What color is your {subject}?",
+    "type": "What kind of {subject} do you have?",
+    "place": "Where did you go for your {subject}?",
+    "year": "In what year was your {subject}?",
+}
+DEFAULT_TEMPLATE = "What is the {relation} of your {subject}?"
+
+# Fallback distractors used when the catalog doesn't hold enough facts of the same kind
+DEFAULT_DISTRACTORS = {
+    "name": ["John", "Mary", "Robert", "Patricia", "James", "Linda"],
+    "breed": ["Labrador Retriever", "German Shepherd", "Beagle", "Poodle", "Bulldog", "Golden Retriever"],
+    "brand": ["Toyota", "Ford", "Honda", "Chevrolet", "BMW", "Volkswagen"],
+    "color": ["Red", "Blue", "Green", "Black", "White", "Silver"],
+    "type": ["Dog", "Cat", "Bird", "Fish", "Rabbit"],
+    "place": ["London", "Rome", "New York", "Hawaii", "Florida", "Paris"],
+}
+
+
+def normalize_fact(raw: dict) -> Optional[dict]:
+    """Validate an extracted fact and normalize its fields. Returns None if unusable."""
+    if not isinstance(raw, dict):
+        return None
+    subject = str(raw.get("subject", "")).strip()
+    relation = str(raw.get("relation", "")).strip().lower()
+    value = str(raw.get("value", "")).strip()
+    category = str(raw.get("category", "")).strip().lower()
+    if not subject or not value or relation not in RELATION_TEMPLATES or category not in FACT_CATEGORIES:
+        return None
+    # "my sister" / "your dog" -> "sister" / "dog" so templates read naturally
+    subject = re.sub(r"^(my|your|our|the)\s+", "", subject, flags=re.IGNORECASE)
+    return {"subject": subject, "relation": relation, "value": value, "category": category}
+
+
+def build_question(fact: dict, distractors: List[str]) -> dict:
+    """Turn a fact and its distractors into an easy multiple choice survey question."""
+    template = RELATION_TEMPLATES.get(fact["relation"], DEFAULT_TEMPLATE)
+    options = [fact["value"]] + list(distractors)
+    random.shuffle(options)
+    return {
+        "question": template.format(subject=fact["subject"], relation=fact["relation"]),
+        "type": "multiple_choice",
+        "options": options,
+        "correct_answer": fact["value"],
+        "related_memory_ids": [fact["memory_id"]],
+        "difficulty": "easy",
+        "category": fact["category"],
+    }
+
+
+class FactStore:
+    """
+    In-process table of (subject, relation, value, category) facts extracted from memories,
+    indexed by memory and by category so surveys can be assembled without any model calls.
+    """
+
+    def __init__(self):
+        self.is_built = False
+        self._lock = threading.RLock()
+        self._facts: Dict[str, dict] = {}
+        self._by_memory: Dict[str, List[str]] = {}
+        self._by_category: Dict[str, List[str]] = {category: [] for category in FACT_CATEGORIES}
+        # Secondary indexes used to find distractors without scanning the whole table
+        self._by_relation: Dict[str, List[str]] = {}
+        self._by_category_relation: Dict[Tuple[str, str], List[str]] = {}
+        self._by_subject_relation: Dict[Tuple[str, str], List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._facts)
+
+    def clear(self):
+        """Drop every fact and mark the store unbuilt, so it is loaded again on next use."""
+        with self._lock:
+            self.is_built = False
+            self._facts = {}
+            self._by_memory = {}
+            self._by_category = {category: [] for category in FACT_CATEGORIES}
+            self._by_relation = {}
+            self._by_category_relation = {}
+            self._by_subject_relation = {}
+
+    def memory_count(self) -> int:
+        """Number of memories that have at least one fact."""
+        return sum(1 for fact_ids in self._by_memory.values() if fact_ids)
+
+    def facts_for_memory(self, memory_id: str) -> List[dict]:
+        return [dict(self._facts[fact_id]) for fact_id in self._by_memory.get(memory_id, [])]
+
+    def load_fact(self, fact: dict):
+        """Add a persisted fact (which must carry its id and memory_id) to the store."""
+        with self._lock:
+            fact_id = fact["id"]
+            if fact_id in self._facts:
+                self._unindex(fact_id)
+            self._facts[fact_id] = dict(fact)
+            for index, key in self._index_keys(fact):
+                index.setdefault(key, []).append(fact_id)
+
+    def replace_memory_facts(self, memory_id: str, facts: List[dict]) -> List[dict]:
+        """
+        Replace every fact of a memory. Fact ids are derived from the memory id, so the
+        returned facts can be written straight back to the same documents.
+        """
+        with self._lock:
+            for fact_id in list(self._by_memory.get(memory_id, [])):
+                self._unindex(fact_id)
+                del self._facts[fact_id]
+            stored = []
+            for index, fact in enumerate(facts):
+                stored_fact = dict(fact, id=f"{memory_id}_{index}", memory_id=memory_id, last_asked_at=None)
+                self.load_fact(stored_fact)
+                stored.append(dict(stored_fact))
+            return stored
+
+    def distractors_for(self, fact: dict, count: int = 3) -> List[str]:
+        """
+        Pick wrong answers for a fact: values of the same relation in the same category first,
+        then the same relation anywhere, then generic defaults. Values that are also true for
+        the same subject (e.g. two sisters' names) are never used.
+        """
+        relation = fact["relation"]
+        with self._lock:
+            true_values = {
+                self._facts[fact_id]["value"].lower()
+                for fact_id in self._by_subject_relation.get((fact["subject"].lower(), relation), [])
+            }
+            same_category = self._sample_values(self._by_category_relation.get((fact["category"], relation), []))
+            same_relation = self._sample_values(self._by_relation.get(relation, []))
+
+        pools = [same_category, same_relation, self._default_distractors(fact)]
+
+        distractors = []
+        seen = set(true_values)
+        for pool in pools:
+            for value in pool:
+                if len(distractors) == count:
+                    return distractors
+                if value.lower() not in seen:
+                    seen.add(value.lower())
+                    distractors.append(value)
+        return distractors if len(distractors) == count else []
+
+    def build_survey(self, num_questions: int = 3, max_memories: Optional[int] = None) -> Tuple[List[dict], List[str]]:
+        """
+        Build up to num_questions MCQs from the least recently asked facts, at most one per
+        subject/relation and preferring distinct memories. With max_memories, questions come
+        from at most that many memories. Starts from a small window of the least recently
+        asked facts and widens it until the survey is full or the table is exhausted.
+        Returns (questions, fact_ids).
+        """
+        window = num_questions * 20
+        # Subject/relation pairs that can't get enough distractors, so they aren't retried
+        unusable = set()
+        while True:
+            # Only the least recently asked slice of the table needs ordering (random tie-break)
+            with self._lock:
+                total = len(self._facts)
+                facts = heapq.nsmallest(
+                    window,
+                    self._facts.values(),
+                    key=lambda fact: (fact.get("last_asked_at") or "", random.random()),
+                )
+            questions, fact_ids = self._select_questions(facts, num_questions, max_memories, unusable)
+            if len(questions) == num_questions or window >= total:
+                return questions, fact_ids
+            window *= 4
+
+    def _select_questions(self, facts: List[dict], num_questions: int, max_memories: Optional[int],
+                          unusable: set) -> Tuple[List[dict], List[str]]:
+        questions = []
+        asked_fact_ids = []
+        used_subjects = set()
+        used_memories = set()
+        # First pass insists on distinct memories, second pass relaxes that
+        for distinct_memories in (True, False):
+            for fact in facts:
+                if len(questions) == num_questions:
+                    break
+                subject_key = (fact["subject"].lower(), fact["relation"])
+                if subject_key in used_subjects or subject_key in unusable or fact["id"] in asked_fact_ids:
+                    continue
+                if fact["memory_id"] in used_memories:
+                    if distinct_memories:
+                        continue
+                elif max_memories is not None and len(used_memories) >= max_memories:
+                    # Memories only count toward max_memories once they yield a question
+                    continue
+                distractors = self.distractors_for(fact)
+                if not distractors:
+                    unusable.add(subject_key)
+                    continue
+                questions.append(build_question(fact, distractors))
+                asked_fact_ids.append(fact["id"])
+                used_subjects.add(subject_key)
+                used_memories.add(fact["memory_id"])
+        return questions, asked_fact_ids
+
+    def mark_asked(self, fact_ids: List[str], asked_at: str):
+        with self._lock:
+            for fact_id in fact_ids:
+                if fact_id in self._facts:
+                    self._facts[fact_id]["last_asked_at"] = asked_at
+
+    def _default_distractors(self, fact: dict) -> List[str]:
+        if fact["relation"] == "year" and re.fullmatch(r"\d{4}", fact["value"]):
+            year = int(fact["value"])
+            offsets = [-3, -2, -1, 1, 2, 3]
+            random.shuffle(offsets)
+            return [str(year + offset) for offset in offsets]
+        defaults = list(DEFAULT_DISTRACTORS.get(fact["relation"], []))
+        random.shuffle(defaults)
+        return defaults
+
+    def _sample_values(self, fact_ids: List[str], limit: int = 50) -> List[str]:
+        fact_ids = random.sample(fact_ids, min(limit, len(fact_ids)))
+        return [self._facts[fact_id]["value"] for fact_id in fact_ids]
+
+    def _index_keys(self, fact: dict):
+        relation = fact["relation"]
+        return (
+            (self._by_memory, fact["memory_id"]),
+            (self._by_category, fact["category"]),
+            (self._by_relation, relation),
+            (self._by_category_relation, (fact["category"], relation)),
+            (self._by_subject_relation, (fact["subject"].lower(), relation)),
+        )
+
+    def _unindex(self, fact_id: str):
+        for index, key in self._index_keys(self._facts[fact_id]):
+            fact_ids = index.get(key)
+            if fact_ids and fact_id in fact_ids:
+                fact_ids.remove(fact_id)
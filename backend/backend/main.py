@@ -1,12 +1,14 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, Field
 import firebase_admin
 from firebase_admin import credentials, firestore, storage
+from google.api_core.exceptions import NotFound
 import traceback
 from fastapi.responses import JSONResponse, Response
 from random import random
-from typing import List
+from typing import Dict, List, Optional
 import os
 import re
 import json
@@ -15,6 +17,24 @@ import google.generativeai as genai
 from dotenv import load_dotenv
 from PIL import Image
 import io
+import asyncio
+import mimetypes
+import zipfile
+import threading
+from search_index import SearchIndex
+from related_graph import RelatedGraph
+from fact_store import FactStore, FACT_CATEGORIES, RELATION_TEMPLATES, normalize_fact
+from prefetch_buffer import PrefetchRegistry, PrefetchSession
+
+# Optional speedups: orjson for serializing large payloads, brotli for response compression
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
 
 # Load environment variables from .env file
 load_dotenv()
@@ -28,6 +48,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress responses above this many bytes (brotli when available, gzip otherwise)
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_SIZE, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson when it's installed.
+    Returned directly by endpoints with catalog-sized payloads, which also skips
+    FastAPI's per-field jsonable_encoder pass.
+    """
+    def render(self, content) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
 # Initialize Firebase Admin SDK
 FIREBASE_KEY = os.getenv("FIREBASE_KEY")
 cred = credentials.Certificate(FIREBASE_KEY)
@@ -44,6 +83,143 @@ GEMINI_KEY = os.getenv("GEMINI_KEY")
 if GEMINI_KEY:
     genai.configure(api_key=GEMINI_KEY)
 
+# Firestore allows at most 500 writes per batch
+FIRESTORE_BATCH_LIMIT = 500
+
+def commit_in_batches(writes, method: str = "update"):
+    """
+    Apply (doc_ref, fields) writes using as few Firestore batch commits as possible.
+    method is the batch operation to use ("update" or "set").
+    Returns the number of documents written.
+    """
+    written = 0
+    batch = db.batch()
+    pending = 0
+    for doc_ref, fields in writes:
+        getattr(batch, method)(doc_ref, fields)
+        pending += 1
+        if pending == FIRESTORE_BATCH_LIMIT:
+            batch.commit()
+            written += pending
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+        written += pending
+    return written
+
+# In-process full-text index over captions and combined descriptions, plus a sparse
+# related-memories graph persisted on each memory's "related" field.
+# Both are built lazily from Firestore on first use and kept current on upload / description changes.
+RELATED_MAX_NEIGHBORS = 10
+search_index = SearchIndex()
+related_graph = RelatedGraph(max_neighbors=RELATED_MAX_NEIGHBORS)
+_catalog_index_lock = threading.Lock()
+
+def index_memory(doc_id: str, mem: dict):
+    """Add or refresh a memory in the search index."""
+    fields = {
+        field: mem[field]
+        for field in ("filename", "url", "uploaded_at")
+        if mem.get(field) is not None
+    }
+    search_index.add_document(
+        doc_id,
+        mem.get("caption", "") or mem.get("context", ""),
+        mem.get("combined_description", ""),
+        fields=fields,
+    )
+
+def ensure_catalog_indexes():
+    """Build the search index and related graph from the media collection if not built yet."""
+    if search_index.is_built and related_graph.is_built:
+        return
+    with _catalog_index_lock:
+        if search_index.is_built and related_graph.is_built:
+            return
+        indexed_count = 0
+        for doc in db.collection("media").stream():
+            mem = doc.to_dict()
+            if not mem:
+                continue
+            index_memory(doc.id, mem)
+            if "related" in mem:
+                related_graph.load_node(
+                    doc.id, [(edge["id"], edge["score"]) for edge in mem["related"] or []]
+                )
+            indexed_count += 1
+        search_index.is_built = True
+        related_graph.is_built = True
+        print(f"Built search index and related graph over {indexed_count} memories")
+
+def link_related_memories(doc_id: str):
+    """
+    Recompute a memory's nearest neighbors from the search index and persist
+    every neighbor list that changed (at most 2 * RELATED_MAX_NEIGHBORS others).
+    Blocking; call it from async code through asyncio.to_thread.
+    """
+    try:
+        ensure_catalog_indexes()
+        candidates = [(other, round(score, 4)) for other, score in search_index.similar_documents(doc_id)]
+        changed = related_graph.update_node(doc_id, candidates)
+        media_ref = db.collection("media")
+        commit_in_batches(
+            (media_ref.document(node_id), {"related": [
+                {"id": other, "score": score}
+                for other, score in related_graph.neighbors(node_id)
+            ]})
+            for node_id in changed
+        )
+        print(f"Linked {doc_id} to {len(related_graph.neighbors(doc_id))} related memories ({len(changed)} lists updated)")
+        return True
+    except Exception as e:
+        # Related links are an enhancement; never fail the caller because of them
+        print(f"Warning: Failed to link related memories for {doc_id}: {e}")
+        traceback.print_exc()
+        return False
+
+def refresh_memory_indexes(doc_id: str, mem: dict):
+    """Update the search index and related graph after a memory's description changes."""
+    index_memory(doc_id, mem)
+    link_related_memories(doc_id)
+
+# Structured (subject, relation, value, category) facts extracted once per memory at ingest,
+# persisted in the "facts" collection and used to build surveys without any model calls.
+fact_store = FactStore()
+_fact_store_lock = threading.Lock()
+
+def ensure_fact_store():
+    """Load the fact table from the facts collection if it hasn't been loaded yet."""
+    if fact_store.is_built:
+        return
+    with _fact_store_lock:
+        if fact_store.is_built:
+            return
+        for doc in db.collection("facts").stream():
+            fact = doc.to_dict()
+            if not fact:
+                continue
+            fact["id"] = doc.id
+            fact_store.load_fact(fact)
+        fact_store.is_built = True
+        print(f"Loaded {len(fact_store)} facts for {fact_store.memory_count()} memories")
+
+def invalidate_fact_store():
+    """
+    Forget the loaded fact table so the next survey reloads it from the facts collection.
+    Needed once another process (backfill.py) has rewritten or deleted fact documents.
+    """
+    with _fact_store_lock:
+        fact_store.clear()
+
+def get_related_memories(doc_id: str, k: Optional[int] = None):
+    """
+    Return (id, score) neighbors for a memory straight from the graph. Read-only: memories
+    that predate the graph have no neighbors until backfill.py links them.
+    """
+    ensure_catalog_indexes()
+    return related_graph.neighbors(doc_id, k)
+
 @app.get("/")
 def root():
     """Root endpoint providing API information"""
@@ -57,15 +233,20 @@ def root():
             },
             "media": {
                 "POST /upload_media": "Upload images/videos with captions",
+                "POST /upload_media_bulk": "Upload many images/videos with captions (form fields or zip archive)",
                 "GET /media_list": "Retrieve all uploaded memories",
-                "GET /random_memories?k={count}": "Get weighted random memories"
+                "GET /random_memories?k={count}&related={bool}&session_id={id}": "Get weighted random memories (optionally a related set, from a per-session prefetch buffer)",
+                "WS /ws/memories?session_id={id}&prefetch={count}&related={bool}": "Push channel delivering prefetched memories before they are needed",
+                "GET /related/{id}?k={count}": "Get memories related to a memory",
+                "GET /search?q={query}&limit={n}&offset={m}": "Full-text search over captions and descriptions"
             },
             "memory_enhancement": {
                 "POST /update_weights_by_similarity": "Update memory weights based on semantic similarity",
+                "POST /update_weights_by_similarity_batch": "Update memory weights for several queries in one pass",
                 "PUT /reset_weights": "Reset all memory weights to default"
             },
             "surveys": {
-                "GET /generate_survey?limit={n}&min_memories={m}": "Generate AI-powered memory recall survey"
+                "GET /generate_survey?limit={n}&min_memories={m}&use_llm_fallback={bool}": "Generate memory recall survey from extracted facts"
             }
         }
     }
@@ -121,25 +302,18 @@ async def upload_media(
         doc_ref = db.collection("media").add(media_data)[1]  # Returns (timestamp, DocumentReference)
         doc_id = doc_ref.id
         
+        # Make the memory searchable right away; it is linked to related memories once described
+        index_memory(doc_id, media_data)
+        
         # Automatically generate LLM image analysis and combined description
         if GEMINI_KEY:
             print(f"Starting LLM image analysis for uploaded image: {doc_id}")
             try:
-                # Get LLM image analysis
-                llm_analysis = await get_llm_image_analysis(media_url, unique_filename)
-                
-                # Create combined description (prioritizing user caption)
-                if llm_analysis and llm_analysis.strip():
-                    combined_description = await combine_descriptions_with_llm(caption, llm_analysis)
-                    print(f"Created combined description for {doc_id}")
-                else:
-                    # If LLM analysis failed, just use the caption
-                    combined_description = caption
-                    print(f"Using caption only for {doc_id} (LLM analysis unavailable)")
-                
-                # Update the document with the combined description
-                doc_ref.update({"combined_description": combined_description})
-                media_data["combined_description"] = combined_description
+                # Vision analysis + combined description (prioritizing user caption), stored with
+                # its analysis markers; also extracts facts for LLM-free surveys. Shares the
+                # generation with any similarity request that reaches the new memory first.
+                analysis = await describe_memory(caption, media_url, doc_id, doc_ref, unique_filename)
+                media_data.update(analysis)
                 
             except Exception as analysis_error:
                 # If analysis fails, continue without it - don't fail the upload
@@ -151,6 +325,7 @@ async def upload_media(
             # Still store the caption as combined_description for consistency
             doc_ref.update({"combined_description": caption})
             media_data["combined_description"] = caption
+            await asyncio.to_thread(refresh_memory_indexes, doc_id, media_data)
         
         return media_data
 
@@ -159,6 +334,198 @@ async def upload_media(
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"detail": "Upload failed due to server error"})
 
+# Bulk uploads: parallel Storage writes and background analyses are capped separately
+BULK_UPLOAD_CONCURRENCY = int(os.getenv("BULK_UPLOAD_CONCURRENCY", "8"))
+BULK_ANALYSIS_CONCURRENCY = int(os.getenv("BULK_ANALYSIS_CONCURRENCY", "4"))
+ARCHIVE_CAPTIONS_FILE = "captions.json"
+# Largest total uncompressed size accepted for a zip archive, checked before anything is extracted
+BULK_ARCHIVE_MAX_BYTES = int(os.getenv("BULK_ARCHIVE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+def read_upload_archive(archive: zipfile.ZipFile):
+    """
+    List (filename, content_type, read, caption) items in an open zip archive, where
+    read() extracts the member. Captions come from a captions.json {filename: caption}
+    manifest, then a sidecar <name>.txt file, falling back to the file name.
+    """
+    members = [
+        info for info in archive.infolist()
+        if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+        and not os.path.basename(info.filename).startswith(".")
+    ]
+    total_size = sum(info.file_size for info in members)
+    if total_size > BULK_ARCHIVE_MAX_BYTES:
+        raise ValueError(f"archive expands to {total_size} bytes, more than the {BULK_ARCHIVE_MAX_BYTES} byte limit")
+    names = {info.filename for info in members}
+    
+    captions = {}
+    if ARCHIVE_CAPTIONS_FILE in names:
+        captions = json.loads(archive.read(ARCHIVE_CAPTIONS_FILE).decode("utf-8"))
+        if not isinstance(captions, dict):
+            raise ValueError(f"{ARCHIVE_CAPTIONS_FILE} must be a JSON object mapping file names to captions")
+        for name, caption in captions.items():
+            if not isinstance(caption, str):
+                raise ValueError(f"{ARCHIVE_CAPTIONS_FILE} caption for {name} must be a string, got {type(caption).__name__}")
+    
+    items = []
+    for info in members:
+        name = info.filename
+        if name == ARCHIVE_CAPTIONS_FILE or name.endswith(".txt"):
+            continue
+        stem = os.path.splitext(name)[0]
+        caption = captions.get(name) or captions.get(os.path.basename(name))
+        if not caption and f"{stem}.txt" in names:
+            caption = archive.read(f"{stem}.txt").decode("utf-8").strip()
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        items.append((os.path.basename(name), content_type, lambda info=info: archive.read(info), caption or os.path.basename(stem)))
+    return items
+
+async def analyze_uploaded_media(uploads):
+    """
+    Background task for bulk uploads: generate combined descriptions (and facts) for
+    (doc_id, doc_ref, caption, url, filename) uploads, at most BULK_ANALYSIS_CONCURRENCY at a time.
+    """
+    semaphore = asyncio.Semaphore(BULK_ANALYSIS_CONCURRENCY)
+    
+    async def analyze(doc_id, doc_ref, caption, media_url, filename):
+        async with semaphore:
+            try:
+                await get_combined_description(caption, media_url, doc_id, doc_ref, filename, force=True)
+            except Exception as analysis_error:
+                print(f"Warning: LLM image analysis failed for {doc_id}: {analysis_error}")
+                traceback.print_exc()
+    
+    await asyncio.gather(*(analyze(*upload) for upload in uploads))
+    print(f"Finished analysis for {len(uploads)} bulk uploaded memories")
+
+@app.post("/upload_media_bulk")
+async def upload_media_bulk(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(default=[]),
+    captions: List[str] = Form(default=[]),
+    archive: Optional[UploadFile] = File(default=None)
+):
+    """
+    Upload many images/videos with captions in one request, either as repeated
+    'files' + 'captions' form fields (matched by position) or as a zip 'archive'
+    (captions from captions.json or <name>.txt sidecars).
+    
+    Files are read and their blobs written to Storage in parallel (BULK_UPLOAD_CONCURRENCY
+    at a time, so only that many are held in memory), memory documents are committed in
+    Firestore batches, and all LLM analyses are scheduled together in the background.
+    Archives larger than BULK_ARCHIVE_MAX_BYTES uncompressed are rejected. Returns a
+    per-item result.
+    """
+    if files and len(captions) != len(files):
+        raise HTTPException(status_code=400, detail=f"Got {len(files)} files but {len(captions)} captions")
+    
+    opened_archive = None
+    try:
+        # Uploads are spooled to temporary files; each is read only when its turn to be stored comes
+        items = [
+            (upload.filename, upload.content_type, upload.file.read, caption)
+            for upload, caption in zip(files, captions)
+        ]
+        if archive is not None:
+            try:
+                opened_archive = zipfile.ZipFile(archive.file)
+                items.extend(read_upload_archive(opened_archive))
+            except (zipfile.BadZipFile, ValueError) as archive_error:
+                raise HTTPException(status_code=400, detail=f"Invalid archive: {archive_error}")
+        if not items:
+            raise HTTPException(status_code=400, detail="No files provided")
+        
+        import uuid
+        from datetime import datetime
+        semaphore = asyncio.Semaphore(BULK_UPLOAD_CONCURRENCY)
+        
+        async def store(original_filename, content_type, read, caption):
+            async with semaphore:
+                contents = await asyncio.to_thread(read)
+                unique_filename = f"{uuid.uuid4()}_{original_filename}"
+                blob = bucket.blob(unique_filename)
+                await asyncio.to_thread(blob.upload_from_string, contents, content_type=content_type)
+                media_url = await asyncio.to_thread(blob.generate_signed_url, version="v4", expiration=86400)  # 24 hour signed URL
+                return {
+                    "filename": unique_filename,
+                    "url": media_url,
+                    "caption": caption,
+                    "weight": 1.0,
+                    "uploaded_at": datetime.utcnow().isoformat() + "Z",
+                }
+        
+        stored = await asyncio.gather(*(store(*item) for item in items), return_exceptions=True)
+        
+        results = []
+        documents = []
+        media_ref = db.collection("media")
+        for index, (item, media_data) in enumerate(zip(items, stored)):
+            if isinstance(media_data, Exception):
+                print(f"Bulk upload storage error for {item[0]}: {media_data}")
+                results.append({"index": index, "filename": item[0], "status": "failed", "error": str(media_data)})
+                continue
+            if not GEMINI_KEY:
+                # Still store the caption as combined_description for consistency
+                media_data["combined_description"] = media_data["caption"]
+            doc_ref = media_ref.document()
+            documents.append((index, doc_ref, media_data))
+        
+        try:
+            await asyncio.to_thread(
+                commit_in_batches, ((doc_ref, media_data) for _, doc_ref, media_data in documents), "set"
+            )
+        except Exception as commit_error:
+            print(f"Bulk upload Firestore commit error: {commit_error}")
+            traceback.print_exc()
+            results.extend(
+                {"index": index, "filename": items[index][0], "status": "failed", "error": "Failed to save memory"}
+                for index, _, _ in documents
+            )
+            documents = []
+        
+        for index, doc_ref, media_data in documents:
+            index_memory(doc_ref.id, media_data)
+            results.append({
+                "index": index,
+                "filename": items[index][0],
+                "status": "uploaded",
+                "id": doc_ref.id,
+                "stored_filename": media_data["filename"],
+                "url": media_data["url"],
+                "caption": media_data["caption"]
+            })
+        results.sort(key=lambda result: result["index"])
+        
+        if not GEMINI_KEY and documents:
+            # Without analyses to wait for, link the new memories into the related graph now
+            def link_uploaded_memories():
+                for _, doc_ref, _ in documents:
+                    link_related_memories(doc_ref.id)
+            await asyncio.to_thread(link_uploaded_memories)
+        
+        if GEMINI_KEY and documents:
+            background_tasks.add_task(analyze_uploaded_media, [
+                (doc_ref.id, doc_ref, media_data["caption"], media_data["url"], media_data["filename"])
+                for _, doc_ref, media_data in documents
+            ])
+        
+        return {
+            "message": f"Uploaded {len(documents)} of {len(items)} files",
+            "uploaded": len(documents),
+            "failed": len(items) - len(documents),
+            "analysis_scheduled": bool(GEMINI_KEY and documents),
+            "items": results
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        print("Bulk upload error:", e)
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"detail": "Bulk upload failed due to server error"})
+    finally:
+        if opened_archive is not None:
+            opened_archive.close()
+
 @app.get("/media_list")
 def media_list():
     media_ref = db.collection("media")
@@ -174,12 +541,275 @@ def media_list():
             "weight": data.get("weight", 1.0),
             "uploaded_at": data.get("uploaded_at"),
         })
-    return media_items
+    return FastJSONResponse(content=media_items)
+
+@app.get("/search")
+def search_memories(
+    q: str = Query(..., min_length=1, description="Free-text query, e.g. 'dog' or 'Paris'"),
+    limit: int = Query(default=20, ge=1, le=100, description="Maximum number of results to return"),
+    offset: int = Query(default=0, ge=0, description="Number of ranked results to skip")
+):
+    """
+    Rank memories against a free-text query using the in-process BM25 index
+    over captions and combined descriptions. No LLM calls are made.
+    """
+    try:
+        ensure_catalog_indexes()
+        total, ranked = search_index.search(q, limit=limit, offset=offset)
+        
+        results = []
+        for doc_id, score in ranked:
+            document = search_index.get_document(doc_id) or {"id": doc_id}
+            results.append({
+                "id": doc_id,
+                "filename": document.get("filename"),
+                "url": document.get("url"),
+                "caption": document.get("caption", ""),
+                "combined_description": document.get("combined_description", ""),
+                "uploaded_at": document.get("uploaded_at"),
+                "score": round(score, 4),
+            })
+        
+        return {
+            "query": q,
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "results": results
+        }
+    
+    except Exception as e:
+        print("Search error:", e)
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail="Failed to search memories")
 
 # --- MODIFIED ENDPOINT ---
 
+def select_related_items(weighted_items, count: int):
+    """
+    Pick a coherent set of memories from A-ES ranked (key, item, doc_ref) tuples
+    (sorted by key, descending). The top-ranked memory seeds the set, which is filled
+    with memories reachable from it in the related graph, best keys first. Falls back
+    to the global ranking when the neighborhood is too small.
+    """
+    by_id = {item["id"]: (key, item, doc_ref) for key, item, doc_ref in weighted_items}
+    seed_id = weighted_items[0][1]["id"]
+    
+    # Breadth-first walk over related links, bounded to a few candidates per slot
+    visited = {seed_id}
+    frontier = [seed_id]
+    neighborhood = []
+    while frontier and len(neighborhood) < count * 3:
+        next_frontier = []
+        for node_id in frontier:
+            for other_id, _ in get_related_memories(node_id):
+                if other_id in visited or other_id not in by_id:
+                    continue
+                visited.add(other_id)
+                neighborhood.append(other_id)
+                next_frontier.append(other_id)
+        frontier = next_frontier
+    
+    neighborhood.sort(key=lambda doc_id: by_id[doc_id][0], reverse=True)
+    selected = [by_id[seed_id]] + [by_id[doc_id] for doc_id in neighborhood[:count - 1]]
+    
+    if len(selected) < count:
+        selected_ids = {item["id"] for _, item, _ in selected}
+        for entry in weighted_items:
+            if len(selected) >= count:
+                break
+            if entry[1]["id"] not in selected_ids:
+                selected.append(entry)
+    
+    return selected
+
+def rank_memories(exclude_ids=frozenset()):
+    """
+    Stream the media collection and rank memories with A-ES keys (see random_memories).
+    Returns (key, item_data, doc_ref) tuples sorted by key, descending.
+    """
+    media_ref = db.collection("media")
+    docs = media_ref.stream()
+    
+    weighted_items = []
+    
+    for doc in docs:
+        mem = doc.to_dict()
+        if not mem or doc.id in exclude_ids:
+            continue
+
+        # Ensure weight is positive (minimum 0.1)
+        weight = max(mem.get("weight", 1.0), 0.1)
+        rand_val = random()  # Generates a float in [0.0, 1.0)
+        
+        # Handle the edge case of rand_val = 0.0 to avoid math domain error
+        if rand_val == 0.0:
+             key = float('inf') # Assign a very large key
+        else:
+             # This is the core of the algorithm
+             key = rand_val ** (1.0 / weight)
+        
+        item_data = {
+            "id": doc.id,
+            "filename": mem.get("filename"),
+            "url": mem.get("url"),
+            "caption": mem.get("caption", ""),
+            "weight": mem.get("weight", 1.0),
+            "uploaded_at": mem.get("uploaded_at"),
+        }
+        # Store both the key, item_data, and document reference for weight updates
+        weighted_items.append((key, item_data, doc.reference))
+    
+    # Sort by the calculated key in descending order
+    weighted_items.sort(key=lambda x: x[0], reverse=True)
+    return weighted_items
+
+# Per-session prefetch buffers behind /random_memories?session_id= and /ws/memories.
+# Each buffer is refilled in the background from a single ranking of the catalog.
+# Weight changes (similarity updates, resets) bump the generation, which invalidates
+# every buffer; delivered memories are dropped from all buffers straight away.
+PREFETCH_BUFFER_SIZE = int(os.getenv("PREFETCH_BUFFER_SIZE", "20"))
+PREFETCH_SESSION_TTL = int(os.getenv("PREFETCH_SESSION_TTL", "1800"))  # seconds
+prefetch_sessions = PrefetchRegistry(ttl=PREFETCH_SESSION_TTL)
+_weights_generation = 0
+# Delivered memories whose weight write hasn't landed yet; refills must not sample them
+_unsettled_shown = set()
+_prefetch_loop = None
+_background_tasks = set()
+
+def spawn_background(coroutine) -> asyncio.Task:
+    """Run a coroutine in the background, keeping a reference until it finishes."""
+    task = asyncio.ensure_future(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+def invalidate_prefetch_buffers():
+    """
+    Call after memory weights change. Buffered samples from older weights are discarded
+    and every session is refilled in the background. Safe to call from worker threads.
+    """
+    global _weights_generation
+    _weights_generation += 1
+    if _prefetch_loop is not None and len(prefetch_sessions):
+        try:
+            _prefetch_loop.call_soon_threadsafe(refill_all_prefetch_sessions)
+        except RuntimeError:
+            # The loop that served the sessions has shut down
+            pass
+
+def refill_all_prefetch_sessions():
+    for session in prefetch_sessions:
+        schedule_prefetch_refill(session)
+
+def sample_prefetch_items(count: int, related: bool, set_size: int, exclude_ids) -> List[dict]:
+    """
+    Sample up to `count` memories in delivery order from one ranking of the catalog.
+    In related mode the items are consecutive related sets of `set_size` memories.
+    """
+    weighted_items = rank_memories(exclude_ids)
+    if not related:
+        return [item for key, item, doc_ref in weighted_items[:count]]
+    
+    items = []
+    remaining = weighted_items
+    while remaining and len(items) < count:
+        selected = select_related_items(remaining, min(set_size, len(remaining)))
+        selected_ids = {item["id"] for key, item, doc_ref in selected}
+        items.extend(item for key, item, doc_ref in selected)
+        remaining = [entry for entry in remaining if entry[1]["id"] not in selected_ids]
+    return items
+
+def prefetch_target(session: PrefetchSession, count: int = 0) -> int:
+    return max(PREFETCH_BUFFER_SIZE, session.set_size * 2, count)
+
+async def refill_prefetch_session(session: PrefetchSession, count: int = 0):
+    """
+    Top a session's buffer up to its target (at least `count` memories); resamples if
+    weights change mid-refill.
+    """
+    for _ in range(3):
+        generation = _weights_generation
+        related, set_size = session.related, session.set_size
+        if session.generation != generation:
+            session.clear()
+        needed = prefetch_target(session, count) - len(session)
+        if needed <= 0:
+            return
+        exclude_ids = session.buffered_ids() | session.pending | _unsettled_shown
+        session.discarded = set()
+        try:
+            items = await asyncio.to_thread(sample_prefetch_items, needed, related, set_size, exclude_ids)
+        except Exception as e:
+            print(f"Warning: Failed to refill prefetch buffer for session {session.session_id}: {e}")
+            traceback.print_exc()
+            return
+        if generation != _weights_generation or not session.samples_like(related, set_size):
+            continue
+        session.extend(items, generation)
+        print(f"Prefetched {len(items)} memories for session {session.session_id} ({len(session)} buffered)")
+        return
+
+def schedule_prefetch_refill(session: PrefetchSession, count: int = 0) -> asyncio.Task:
+    if session.refill_task is None or session.refill_task.done():
+        session.refill_task = spawn_background(refill_prefetch_session(session, count))
+    return session.refill_task
+
+def get_prefetch_session(session_id: str) -> PrefetchSession:
+    global _prefetch_loop
+    _prefetch_loop = asyncio.get_running_loop()
+    return prefetch_sessions.get(session_id)
+
+async def take_prefetched(session: PrefetchSession, count: int, related: bool, set_size: int) -> List[dict]:
+    """
+    Pop up to `count` memories from a session's buffer, waiting for a refill only when the
+    buffer runs dry, and start a background refill once it drops below half its target.
+    """
+    async with session.lock:
+        session.touch()
+        session.configure(related, set_size)
+        if session.generation != _weights_generation:
+            session.clear()
+        # A refill already in flight may have been sized for an older request, so try twice
+        for _ in range(2):
+            if len(session) >= count:
+                break
+            await asyncio.shield(schedule_prefetch_refill(session, count))
+        items = session.take(count)
+        if len(session) < max(session.set_size, prefetch_target(session) // 2):
+            schedule_prefetch_refill(session)
+        return items
+
+async def write_shown_weights(memory_ids: List[str]):
+    try:
+        media_ref = db.collection("media")
+        await asyncio.to_thread(
+            commit_in_batches, [(media_ref.document(memory_id), {"weight": 0}) for memory_id in memory_ids]
+        )
+        print(f"Updated weights to 0 for {len(memory_ids)} selected memories")
+    except Exception as update_error:
+        # Log error but don't fail the request
+        print(f"Warning: Failed to update weights for selected memories: {update_error}")
+        traceback.print_exc()
+    finally:
+        _unsettled_shown.difference_update(memory_ids)
+
+def mark_memories_shown(memory_ids: List[str]) -> asyncio.Task:
+    """
+    Set delivered memories' weights to 0 so they're unlikely to be selected again, and drop
+    them from every prefetch buffer right away. Returns the task writing the weights.
+    """
+    for session in prefetch_sessions:
+        session.discard(memory_ids)
+    _unsettled_shown.update(memory_ids)
+    return spawn_background(write_shown_weights(memory_ids))
+
 @app.get("/random_memories")
-def random_memories(k: int = Query(default=1, ge=1, description="Number of random memories to return")):
+async def random_memories(
+    k: int = Query(default=1, ge=1, description="Number of random memories to return"),
+    related: bool = Query(default=False, description="Return a coherent set of related memories around a weighted random seed"),
+    session_id: Optional[str] = Query(default=None, min_length=1, description="Serve from this client's prefetch buffer")
+):
     """
     Get 'k' random memories using A-ES weighted random sampling without replacement.
     
@@ -194,64 +824,40 @@ def random_memories(k: int = Query(default=1, ge=1, description="Number of rando
     - For each item 'i' with weight 'w_i', calculate a key = random()^(1/w_i).
     - Select the 'k' items with the largest keys.
     - Update selected items' weights to 0.1 in Firestore to prevent immediate re-selection.
+    
+    With related=true, the top-ranked memory seeds the selection and the rest are drawn
+    from its neighborhood in the related-memories graph (see /related/{id}).
+    
+    With a session_id, memories come from that client's prefetch buffer, which the server
+    keeps filled in the background with samples drawn the same way, so no catalog stream
+    happens on the request path. Weights are written after the response is sent.
     """
     try:
-        media_ref = db.collection("media")
-        docs = media_ref.stream()
+        if session_id:
+            session = get_prefetch_session(session_id)
+            selected_memories = await take_prefetched(session, k, related, set_size=k)
+            if selected_memories:
+                mark_memories_shown([item["id"] for item in selected_memories])
+            return selected_memories
         
-        weighted_items = []
-        
-        for doc in docs:
-            mem = doc.to_dict()
-            if not mem:
-                continue
-
-            # Ensure weight is positive (minimum 0.1)
-            weight = max(mem.get("weight", 1.0), 0.1)
-            rand_val = random()  # Generates a float in [0.0, 1.0)
-            
-            # Handle the edge case of rand_val = 0.0 to avoid math domain error
-            if rand_val == 0.0:
-                 key = float('inf') # Assign a very large key
-            else:
-                 # This is the core of the algorithm
-                 key = rand_val ** (1.0 / weight)
-            
-            item_data = {
-                "id": doc.id,
-                "filename": mem.get("filename"),
-                "url": mem.get("url"),
-                "caption": mem.get("caption", ""),
-                "weight": mem.get("weight", 1.0),
-                "uploaded_at": mem.get("uploaded_at"),
-            }
-            # Store both the key, item_data, and document reference for weight updates
-            weighted_items.append((key, item_data, doc.reference))
+        weighted_items = await asyncio.to_thread(rank_memories)
 
         if not weighted_items:
             return []
-            
-        # Sort by the calculated key in descending order
-        weighted_items.sort(key=lambda x: x[0], reverse=True)
         
         # Get the number of items to return, capped by the total available
         num_to_return = min(k, len(weighted_items))
         
-        # Extract the selected items and their document references
-        selected_data = weighted_items[:num_to_return]
+        # Extract the selected items
+        if related:
+            selected_data = await asyncio.to_thread(select_related_items, weighted_items, num_to_return)
+        else:
+            selected_data = weighted_items[:num_to_return]
         selected_memories = [item for key, item, doc_ref in selected_data]
-        selected_doc_refs = [doc_ref for key, item, doc_ref in selected_data]
         
-        # Update weights of selected images to a very low value (0.1) so they're unlikely to be selected again
+        # Update weights of selected images to a very low value so they're unlikely to be selected again
         # This ensures images that have been shown recently won't be shown again soon
-        try:
-            for doc_ref in selected_doc_refs:
-                doc_ref.update({"weight": 0})
-            print(f"Updated weights to 0.1 for {len(selected_doc_refs)} selected memories")
-        except Exception as update_error:
-            # Log error but don't fail the request
-            print(f"Warning: Failed to update weights for selected memories: {update_error}")
-            traceback.print_exc()
+        await mark_memories_shown([item["id"] for item in selected_memories])
 
         return selected_memories
 
@@ -260,10 +866,138 @@ def random_memories(k: int = Query(default=1, ge=1, description="Number of rando
         traceback.print_exc()
         raise HTTPException(status_code=500, detail="Failed to retrieve random memories")
 
+@app.websocket("/ws/memories")
+async def memories_socket(
+    websocket: WebSocket,
+    session_id: str = Query(..., min_length=1),
+    prefetch: int = Query(default=3, ge=1, le=PREFETCH_BUFFER_SIZE),
+    related: bool = Query(default=False)
+):
+    """
+    Push channel for the AR client. Right after connecting, the server pushes `prefetch`
+    memories as {"type": "memory", "memory": {...}}, before the client needs them.
+    
+    Client messages:
+    - {"type": "shown", "id": "..."}: the memory was displayed; its weight is set to 0 and
+      a replacement is pushed, so `prefetch` memories are always waiting on the client
+    - {"type": "next", "count": n}: push n more memories
+    
+    Memories pushed but never reported as shown are returned to the pool on disconnect.
+    With related=true, memories arrive as consecutive related sets of `prefetch` memories.
+    """
+    await websocket.accept()
+    session = get_prefetch_session(session_id)
+    session.connections += 1
+    pushed = set()
+    
+    async def push(count: int):
+        memories = await take_prefetched(session, count, related, set_size=prefetch)
+        for memory in memories:
+            pushed.add(memory["id"])
+            session.pending.add(memory["id"])
+            await websocket.send_json({"type": "memory", "memory": memory})
+        if not memories:
+            await websocket.send_json({"type": "empty"})
+    
+    try:
+        await push(prefetch)
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                message_type = message.get("type")
+            except (ValueError, AttributeError):
+                await websocket.send_json({"type": "error", "detail": "Messages must be JSON objects"})
+                continue
+            session.touch()
+            
+            if message_type == "shown":
+                memory_id = message.get("id")
+                if memory_id not in pushed:
+                    await websocket.send_json({"type": "error", "detail": f"Memory {memory_id} was not pushed on this connection"})
+                    continue
+                pushed.discard(memory_id)
+                session.pending.discard(memory_id)
+                mark_memories_shown([memory_id])
+                await push(1)
+            elif message_type == "next":
+                try:
+                    count = int(message.get("count", 1))
+                except (TypeError, ValueError):
+                    count = 1
+                await push(max(1, min(count, PREFETCH_BUFFER_SIZE)))
+            else:
+                await websocket.send_json({"type": "error", "detail": f"Unknown message type: {message_type}"})
+    
+    except WebSocketDisconnect:
+        print(f"Memory push channel closed for session {session_id}")
+    except Exception as e:
+        print("Memory push channel error:", e)
+        traceback.print_exc()
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        session.connections -= 1
+        session.pending -= pushed
+        session.touch()
+
 # --- END OF MODIFIED ENDPOINT ---
 
+@app.get("/related/{doc_id}")
+def related_memories(
+    doc_id: str,
+    k: int = Query(default=5, ge=1, le=RELATED_MAX_NEIGHBORS, description="Number of related memories to return")
+):
+    """
+    Get the memories most closely related to a memory (same people, places, objects),
+    read directly from the precomputed related-memories graph.
+    """
+    try:
+        ensure_catalog_indexes()
+        if doc_id not in search_index:
+            raise HTTPException(status_code=404, detail=f"Memory {doc_id} not found")
+        
+        related = []
+        for other_id, score in get_related_memories(doc_id, k):
+            document = search_index.get_document(other_id) or {}
+            related.append({
+                "id": other_id,
+                "filename": document.get("filename"),
+                "url": document.get("url"),
+                "caption": document.get("caption", ""),
+                "uploaded_at": document.get("uploaded_at"),
+                "score": score,
+            })
+        
+        return {
+            "id": doc_id,
+            "k": k,
+            "related": related
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        print("Related memories error:", e)
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail="Failed to retrieve related memories")
+
 class SimilarityRequest(BaseModel):
     query: str
+    # If set, only the top-N search index matches are scored by the LLM
+    candidate_limit: Optional[int] = Field(default=None, ge=1)
+    # False returns only ids, scores and weights (no captions, descriptions, reasoning or all_scores)
+    verbose: bool = True
+
+class BatchSimilarityRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1)
+    # Optional per-query multipliers applied to each similarity score (defaults to 1.0 each)
+    weights: Optional[List[float]] = None
+    # If set, only the union of each query's top-N search index matches is scored by the LLM
+    candidate_limit: Optional[int] = Field(default=None, ge=1)
+    # False returns only ids, per-query scores and weights
+    verbose: bool = True
 
 async def get_llm_image_analysis(image_url: str, filename: str = None) -> str:
     """
@@ -281,7 +1015,7 @@ async def get_llm_image_analysis(image_url: str, filename: str = None) -> str:
         # Download the image
         print("Downloading image...")
         try:
-            response = requests.get(image_url, timeout=30)
+            response = await asyncio.to_thread(requests.get, image_url, timeout=30)
             response.raise_for_status()
             print(f"Image downloaded successfully, size: {len(response.content)} bytes")
         except requests.exceptions.HTTPError as e:
@@ -292,7 +1026,7 @@ async def get_llm_image_analysis(image_url: str, filename: str = None) -> str:
                     blob = bucket.blob(filename)
                     new_url = blob.generate_signed_url(version="v4", expiration=172800)
                     print(f"Generated new signed URL, retrying download...")
-                    response = requests.get(new_url, timeout=30)
+                    response = await asyncio.to_thread(requests.get, new_url, timeout=30)
                     response.raise_for_status()
                     print(f"Image downloaded successfully with new URL, size: {len(response.content)} bytes")
                 except Exception as retry_error:
@@ -317,7 +1051,7 @@ async def get_llm_image_analysis(image_url: str, filename: str = None) -> str:
         Keep it concise (2-3 sentences maximum)."""
         
         print("Calling Gemini Vision API...")
-        vision_response = vision_model.generate_content([vision_prompt, image])
+        vision_response = await asyncio.to_thread(vision_model.generate_content, [vision_prompt, image])
         description = vision_response.text.strip()
         print(f"Gemini Vision response: '{description}'")
         
@@ -359,7 +1093,7 @@ Instructions:
 
 Respond with ONLY the combined description, nothing else."""
 
-        response = model.generate_content(prompt)
+        response = await asyncio.to_thread(model.generate_content, prompt)
         combined = response.text.strip()
         
         if not combined:
@@ -374,61 +1108,276 @@ Respond with ONLY the combined description, nothing else."""
         # Fallback to simple combination if LLM fails
         return f"{user_context}. Visual context: {visual_analysis}"
 
-async def get_combined_description(caption: str, image_url: str, doc_id: str, doc_ref, filename: str = None) -> str:
+async def extract_memory_facts(combined_description: str) -> List[dict]:
     """
-    Get or create a combined description that merges user context (caption) with LLM image analysis.
-    Prioritizes user context. Caches the combined description in Firestore.
+    Use LLM to extract structured facts about the patient's life from a memory description.
+    Returns a list of normalized {subject, relation, value, category} dicts.
+    """
+    model = genai.GenerativeModel('gemini-2.5-flash')
+    
+    prompt = f"""Extract general facts about a patient's life from this memory description. The facts will be used to ask easy multiple choice recall questions like "What breed is your dog?" or "What is your sister's name?".
+
+Memory description:
+{combined_description}
+
+Rules:
+- Only extract facts that are explicitly stated in the description
+- "subject" is the person, pet, thing or event the fact is about, from the patient's point of view, without "my"/"your" (e.g. "dog", "sister", "car", "vacation", "wedding")
+- "relation" must be one of: {", ".join(RELATION_TEMPLATES)}
+- "value" is the short answer (1-4 words), e.g. "Golden Retriever", "Susan", "Toyota", "Paris"
+- "category" must be one of: {", ".join(FACT_CATEGORIES)}
+- Return at most 5 facts, or an empty array if there are none
+
+Return ONLY a JSON array using this exact structure, no markdown, no explanations:
+[{{"subject": "dog", "relation": "breed", "value": "Golden Retriever", "category": "objects"}}]"""
+    
+    response = await asyncio.to_thread(model.generate_content, prompt)
+    facts_text = response.text.strip().replace("```json", "").replace("```", "").strip()
+    raw_facts = json.loads(facts_text)
+    if not isinstance(raw_facts, list):
+        raise ValueError("Fact extraction must return a JSON array")
+    
+    facts = []
+    for raw_fact in raw_facts:
+        fact = normalize_fact(raw_fact)
+        if fact:
+            facts.append(fact)
+    return facts
+
+async def update_memory_facts(doc_id: str, doc_ref, combined_description: str):
+    """
+    Extract facts for a memory and replace its rows in the facts collection.
+    Marks the memory with facts_status so failed extractions can be found later.
     """
+    if not GEMINI_KEY:
+        return
     try:
-        # Check if we already have a cached combined description
-        doc_data = doc_ref.get().to_dict()
-        cached_combined = doc_data.get("combined_description", "")
-        
-        # Only use cached if it exists and is different from just the caption
-        # If cached description is just the caption, regenerate it to include LLM analysis
-        if cached_combined and cached_combined != caption and len(cached_combined) > len(caption) + 10:
-            # Check if it's likely a combined description (longer than just caption)
-            print(f"Using cached combined description for document {doc_id}")
-            return cached_combined
-        elif cached_combined:
-            print(f"Cached description exists but may lack visual context, regenerating for document {doc_id}")
-        
-        print(f"Creating combined description for document {doc_id}...")
-        print(f"Image URL: {image_url}")
-        print(f"Caption: {caption}")
-        
-        # Get LLM image analysis (if image URL is available)
-        llm_analysis = ""
-        if image_url:
-            print(f"Attempting to get LLM image analysis for document {doc_id}...")
-            llm_analysis = await get_llm_image_analysis(image_url, filename)
-            print(f"LLM analysis result for {doc_id}: '{llm_analysis}'")
-            if not llm_analysis:
-                print(f"WARNING: LLM analysis returned empty for {doc_id}. Check logs above for errors.")
-        else:
-            print(f"No image URL provided for document {doc_id}")
+        facts = await extract_memory_facts(combined_description)
+        ensure_fact_store()
+        previous_count = len(fact_store.facts_for_memory(doc_id))
+        stored_facts = fact_store.replace_memory_facts(doc_id, facts)
         
-        # Create combined description using LLM to intelligently merge, prioritizing user context
-        if llm_analysis and llm_analysis.strip():
-            # Use LLM to combine the descriptions with priority on user context
-            combined_description = await combine_descriptions_with_llm(caption, llm_analysis)
-            print(f"Created combined description with LLM analysis for {doc_id}")
-        else:
-            # If no image analysis available, just use caption
-            combined_description = caption
-            print(f"Using caption only for {doc_id} (no LLM analysis available)")
+        facts_ref = db.collection("facts")
+        commit_in_batches(
+            ((facts_ref.document(fact["id"]), {key: value for key, value in fact.items() if key != "id"})
+             for fact in stored_facts),
+            method="set"
+        )
+        for index in range(len(stored_facts), previous_count):
+            facts_ref.document(f"{doc_id}_{index}").delete()
+        
+        doc_ref.update({"facts_status": "complete", "fact_count": len(stored_facts)})
+        print(f"Extracted {len(stored_facts)} facts for {doc_id}")
+    except Exception as e:
+        # Facts only power LLM-free surveys; never fail the caller because of them
+        print(f"Warning: Fact extraction failed for {doc_id}: {e}")
+        traceback.print_exc()
+        try:
+            doc_ref.update({"facts_status": "failed"})
+        except Exception:
+            traceback.print_exc()
+
+# Bump when the vision prompt in get_llm_image_analysis or the merge prompt in
+# combine_descriptions_with_llm changes, then run backfill.py to regenerate stored
+# descriptions. Request paths keep using older settled descriptions until then.
+ANALYSIS_VERSION = 1
+# Descriptions written before the analysis markers existed
+LEGACY_ANALYSIS_VERSION = 0
+# "complete": vision + merge succeeded; "caption_only": no image to analyze;
+# "failed": vision analysis returned nothing (left for the backfill job to retry)
+SETTLED_ANALYSIS_STATUSES = ("complete", "caption_only", "failed")
+
+# In-flight description generations keyed by document id, so concurrent callers share one
+_description_flights: Dict[str, asyncio.Future] = {}
+
+def stored_analysis_version(mem: dict) -> Optional[int]:
+    """
+    The analysis_version of a memory's stored combined description. Unmarked descriptions
+    that pass the old "longer than the caption" check count as LEGACY_ANALYSIS_VERSION;
+    other unmarked memories have no usable description (None).
+    """
+    if "analysis_version" in mem:
+        return mem["analysis_version"]
+    description = mem.get("combined_description", "")
+    caption = mem.get("caption", "") or mem.get("context", "")
+    if description and description != caption and len(description) > len(caption) + 10:
+        return LEGACY_ANALYSIS_VERSION
+    return None
+
+def has_settled_analysis(mem: dict) -> bool:
+    """Whether a memory's stored combined description can be reused, from any analysis version."""
+    version = stored_analysis_version(mem)
+    if version is None:
+        return False
+    return version == LEGACY_ANALYSIS_VERSION or mem.get("analysis_status") in SETTLED_ANALYSIS_STATUSES
+
+def has_current_analysis(mem: dict) -> bool:
+    """Whether a memory's stored combined description is settled for the current analysis version."""
+    return (
+        stored_analysis_version(mem) == ANALYSIS_VERSION
+        and mem.get("analysis_status") in SETTLED_ANALYSIS_STATUSES
+    )
+
+async def generate_combined_description(caption: str, image_url: str, doc_id: str, doc_ref, filename: str = None) -> dict:
+    """
+    Run LLM image analysis and merge it with the user context (caption), then store the
+    combined description with its analysis_status / analysis_version markers, refresh the
+    search index and related graph, and extract facts.
+    Returns the fields written to the memory document.
+    """
+    print(f"Creating combined description for document {doc_id}...")
+    print(f"Image URL: {image_url}")
+    print(f"Caption: {caption}")
+    
+    # Get LLM image analysis (if image URL is available)
+    llm_analysis = ""
+    if image_url:
+        print(f"Attempting to get LLM image analysis for document {doc_id}...")
+        llm_analysis = await get_llm_image_analysis(image_url, filename)
+        print(f"LLM analysis result for {doc_id}: '{llm_analysis}'")
+        if not llm_analysis:
+            print(f"WARNING: LLM analysis returned empty for {doc_id}. Check logs above for errors.")
+    else:
+        print(f"No image URL provided for document {doc_id}")
+    
+    # Create combined description using LLM to intelligently merge, prioritizing user context
+    if llm_analysis and llm_analysis.strip():
+        # Use LLM to combine the descriptions with priority on user context
+        combined_description = await combine_descriptions_with_llm(caption, llm_analysis)
+        analysis_status = "complete"
+        print(f"Created combined description with LLM analysis for {doc_id}")
+    else:
+        # If no image analysis available, just use caption
+        combined_description = caption
+        analysis_status = "failed" if image_url else "caption_only"
+        print(f"Using caption only for {doc_id} (no LLM analysis available)")
+    
+    # Cache the combined description in Firestore
+    from datetime import datetime
+    analysis = {
+        "combined_description": combined_description,
+        "analysis_status": analysis_status,
+        "analysis_version": ANALYSIS_VERSION,
+        "analyzed_at": datetime.utcnow().isoformat() + "Z",
+    }
+    doc_ref.update(analysis)
+    await asyncio.to_thread(refresh_memory_indexes, doc_id, {"caption": caption, "combined_description": combined_description})
+    print(f"Cached combined description for document {doc_id}")
+    
+    await update_memory_facts(doc_id, doc_ref, combined_description)
+    
+    return analysis
+
+async def describe_memory(caption: str, image_url: str, doc_id: str, doc_ref, filename: str = None) -> dict:
+    """
+    Generate a memory's combined description, or join the generation already running for
+    it, so concurrent callers share one. Returns the fields written to the memory document.
+    """
+    flight = _description_flights.get(doc_id)
+    if flight is None:
+        flight = asyncio.ensure_future(generate_combined_description(caption, image_url, doc_id, doc_ref, filename))
+        _description_flights[doc_id] = flight
         
-        # Cache the combined description in Firestore
-        doc_ref.update({"combined_description": combined_description})
-        print(f"Cached combined description for document {doc_id}")
+        def clear_flight(done, doc_id=doc_id):
+            if _description_flights.get(doc_id) is done:
+                del _description_flights[doc_id]
+        flight.add_done_callback(clear_flight)
+    else:
+        print(f"Waiting for in-flight description generation for document {doc_id}")
+    
+    # Shield the shared generation so one caller disconnecting doesn't cancel it for the others
+    return await asyncio.shield(flight)
+
+async def get_combined_description(caption: str, image_url: str, doc_id: str, doc_ref, filename: str = None,
+                                   doc_data: Optional[dict] = None, force: bool = False) -> str:
+    """
+    Get or create a combined description that merges user context (caption) with LLM image analysis.
+    Prioritizes user context. Caches the combined description in Firestore.
+    
+    Pass the document's already-loaded data as doc_data to avoid reading it again. Any settled
+    stored description is reused, including ones from older analysis versions (backfill.py
+    upgrades those); force=True regenerates regardless. Concurrent calls for the same
+    document await a single generation.
+    """
+    try:
+        if not force:
+            if (doc_data is None or not has_settled_analysis(doc_data)) and doc_id not in _description_flights:
+                # Preloaded data may predate a generation that finished since; check the stored copy
+                doc_data = doc_ref.get().to_dict() or {}
+            if doc_data is not None and has_settled_analysis(doc_data):
+                print(f"Using cached combined description for document {doc_id}")
+                return doc_data.get("combined_description") or caption
+            if doc_id not in _description_flights:
+                print(f"No usable analysis (version {doc_data.get('analysis_version')}, status {doc_data.get('analysis_status')}), generating for document {doc_id}")
         
-        return combined_description
+        analysis = await describe_memory(caption, image_url, doc_id, doc_ref, filename)
+        return analysis["combined_description"]
         
     except Exception as e:
         print(f"Error creating combined description for document {doc_id}: {e}")
         traceback.print_exc()
         return caption  # Fallback to just caption if there's an error
 
+# Shared scoring rules for the single-query and batch similarity prompts
+SIMILARITY_GUIDELINES = """CRITICAL: Focus on SEMANTIC MEANING and CONTEXTUAL RELATIONSHIPS, NOT just word matching.
+PRIORITIZE the caption/API context. Use the visual description only as supplementary information to clarify or enhance the caption when needed.
+
+Key principles:
+1. **Contextual Understanding**: Understand the full meaning and relationships in the query, not just individual words.
+   - Example: Query "woman with an American husband" should match images showing marriages/relationships with Americans, NOT just any image with a woman
+   - If the LLM description mentions "married to an American Actor" or similar relationships, this is highly relevant (0.9-1.0)
+   - If the image only shows "Woman sitting on table" without relationship context, this is NOT relevant (0.0-0.3) even though it contains "woman"
+
+2. **Compound Concepts**: When the query combines multiple concepts (e.g., "woman" + "American husband"), prioritize images where BOTH concepts appear in the caption (primary) or are clearly visible in the image (secondary).
+   - Higher score if the caption contains the full relationship/context
+   - If caption is partial, visual details can supplement, but caption takes priority
+   - Lower score if only one part of the concept is mentioned in the caption
+
+3. **Semantic Relationships**: Understand synonyms, related terms, and contextual connections:
+   - "husband" relates to "married", "spouse", "partner", "actor" (if mentioned as spouse)
+   - "American" relates to "US", "United States", nationality contexts
+   - Don't just match keywords - understand the semantic meaning
+
+4. **Relevance Levels** (Caption is PRIMARY, Visual is SECONDARY):
+   - 0.9-1.0: The caption contains the EXACT semantic relationship/context from the query (e.g., query about "woman with American husband" matches caption "actress married to American Actor")
+   - 0.7-0.89: The caption contains most of the key concepts and relationships, with strong semantic similarity
+   - 0.4-0.69: The caption shares some concepts but missing key relationships or context (visual details may help but don't override caption)
+   - 0.0-0.39: Only superficial keyword matches in caption without the meaningful context/relationships
+
+5. **Avoid Word Matching Bias**: A caption that matches keywords but lacks the semantic relationship should score LOW, even if it contains matching words."""
+
+def parse_similarity_response(similarity_text: str):
+    """
+    Extract the similarity score and reasoning from a Gemini similarity response.
+    Returns (score, reasoning) with the score clamped to the 0-1 range.
+    """
+    reasoning = ""
+    similarity_score = 0.0
+    
+    # Try to extract score from "Score: X" format
+    score_match = re.search(r'Score:\s*([0-9]*\.?[0-9]+)', similarity_text, re.IGNORECASE)
+    if score_match:
+        similarity_score = float(score_match.group(1))
+    else:
+        # Fallback: try to find the first float in the response
+        match = re.search(r'0?\.\d+|1\.0|1|0', similarity_text)
+        if match:
+            similarity_score = float(match.group())
+        else:
+            similarity_score = float(similarity_text.split()[0])
+    
+    # Extract reasoning from "Reasoning: X" format
+    reasoning_match = re.search(r'Reasoning:\s*(.+?)(?:\n|$)', similarity_text, re.IGNORECASE | re.DOTALL)
+    if reasoning_match:
+        reasoning = reasoning_match.group(1).strip()
+    else:
+        # If no explicit reasoning section, use the rest of the text after the score
+        reasoning = similarity_text.split('\n', 1)[-1].strip() if '\n' in similarity_text else "No reasoning provided"
+    
+    # Clamp to 0-1 range
+    similarity_score = max(0.0, min(1.0, similarity_score))
+    return similarity_score, reasoning
+
 @app.post("/update_weights_by_similarity")
 async def update_weights_by_similarity(data: SimilarityRequest):
     """
@@ -463,12 +1412,31 @@ async def update_weights_by_similarity(data: SimilarityRequest):
         model = genai.GenerativeModel('gemini-2.5-flash')
         query = data.query
         
+        # Optionally preselect candidates with the search index so only likely matches cost an LLM call
+        candidate_ids = None
+        candidate_fallback = False
+        if data.candidate_limit:
+            ensure_catalog_indexes()
+            _, ranked = search_index.search(query, limit=data.candidate_limit)
+            candidate_ids = {doc_id for doc_id, _ in ranked}
+            print(f"Preselected {len(candidate_ids)} candidates from the search index")
+            if not candidate_ids:
+                # No shared words is exactly where semantic scoring matters, so score every memory
+                print("No keyword matches for the query, scoring every memory")
+                candidate_ids = None
+                candidate_fallback = True
+        
         updated_count = 0
         results = []
         all_scores = []  # Track all scores for debugging
         skipped_no_caption = 0
+        skipped_not_candidate = 0
         
         for doc in docs:
+            if candidate_ids is not None and doc.id not in candidate_ids:
+                skipped_not_candidate += 1
+                continue
+            
             data_dict = doc.to_dict()
             # Check for both "caption" and "context" field names
             caption = data_dict.get("caption", "") or data_dict.get("context", "")
@@ -487,7 +1455,9 @@ async def update_weights_by_similarity(data: SimilarityRequest):
             # Get or create combined description (user context + LLM analysis, prioritized to user context)
             # This is done BEFORE similarity matching
             filename = data_dict.get("filename", "")
-            combined_context = await get_combined_description(caption, image_url, doc.id, doc.reference, filename)
+            combined_context = await get_combined_description(
+                caption, image_url, doc.id, doc.reference, filename, doc_data=data_dict
+            )
             
             # Create improved prompt for similarity comparison
             # This prompt emphasizes semantic and contextual understanding over word matching
@@ -501,32 +1471,7 @@ Image Context (Combined Description - User Context Prioritized):
 
 IMPORTANT: The combined description prioritizes the user-provided context. Use this full context to determine semantic similarity.
 
-CRITICAL: Focus on SEMANTIC MEANING and CONTEXTUAL RELATIONSHIPS, NOT just word matching.
-PRIORITIZE the caption/API context. Use the visual description only as supplementary information to clarify or enhance the caption when needed.
-
-Key principles:
-1. **Contextual Understanding**: Understand the full meaning and relationships in the query, not just individual words.
-   - Example: Query "woman with an American husband" should match images showing marriages/relationships with Americans, NOT just any image with a woman
-   - If the LLM description mentions "married to an American Actor" or similar relationships, this is highly relevant (0.9-1.0)
-   - If the image only shows "Woman sitting on table" without relationship context, this is NOT relevant (0.0-0.3) even though it contains "woman"
-
-2. **Compound Concepts**: When the query combines multiple concepts (e.g., "woman" + "American husband"), prioritize images where BOTH concepts appear in the caption (primary) or are clearly visible in the image (secondary).
-   - Higher score if the caption contains the full relationship/context
-   - If caption is partial, visual details can supplement, but caption takes priority
-   - Lower score if only one part of the concept is mentioned in the caption
-
-3. **Semantic Relationships**: Understand synonyms, related terms, and contextual connections:
-   - "husband" relates to "married", "spouse", "partner", "actor" (if mentioned as spouse)
-   - "American" relates to "US", "United States", nationality contexts
-   - Don't just match keywords - understand the semantic meaning
-
-4. **Relevance Levels** (Caption is PRIMARY, Visual is SECONDARY):
-   - 0.9-1.0: The caption contains the EXACT semantic relationship/context from the query (e.g., query about "woman with American husband" matches caption "actress married to American Actor")
-   - 0.7-0.89: The caption contains most of the key concepts and relationships, with strong semantic similarity
-   - 0.4-0.69: The caption shares some concepts but missing key relationships or context (visual details may help but don't override caption)
-   - 0.0-0.39: Only superficial keyword matches in caption without the meaningful context/relationships
-
-5. **Avoid Word Matching Bias**: A caption that matches keywords but lacks the semantic relationship should score LOW, even if it contains matching words.
+{SIMILARITY_GUIDELINES}
 
 Rate the relevance on a scale of 0 to 1 based on SEMANTIC and CONTEXTUAL similarity, not word overlap.
 
@@ -536,36 +1481,12 @@ Reasoning: [brief explanation focusing on semantic/contextual relationships, not
             
             try:
                 print(f"Calling Gemini API for document {doc.id}...")
-                response = model.generate_content(prompt)
+                response = await asyncio.to_thread(model.generate_content, prompt)
                 similarity_text = response.text.strip()
                 print(f"Gemini response for {doc.id}: '{similarity_text}'")
                 
-                # Extract score and reasoning from response
-                reasoning = ""
-                similarity_score = 0.0
-                
-                # Try to extract score from "Score: X" format
-                score_match = re.search(r'Score:\s*([0-9]*\.?[0-9]+)', similarity_text, re.IGNORECASE)
-                if score_match:
-                    similarity_score = float(score_match.group(1))
-                else:
-                    # Fallback: try to find the first float in the response
-                    match = re.search(r'0?\.\d+|1\.0|1|0', similarity_text)
-                    if match:
-                        similarity_score = float(match.group())
-                    else:
-                        similarity_score = float(similarity_text.split()[0])
-                
-                # Extract reasoning from "Reasoning: X" format
-                reasoning_match = re.search(r'Reasoning:\s*(.+?)(?:\n|$)', similarity_text, re.IGNORECASE | re.DOTALL)
-                if reasoning_match:
-                    reasoning = reasoning_match.group(1).strip()
-                else:
-                    # If no explicit reasoning section, use the rest of the text after the score
-                    reasoning = similarity_text.split('\n', 1)[-1].strip() if '\n' in similarity_text else "No reasoning provided"
-                
-                # Clamp to 0-1 range
-                similarity_score = max(0.0, min(1.0, similarity_score))
+                # Extract score and reasoning from response (clamped to 0-1 range)
+                similarity_score, reasoning = parse_similarity_response(similarity_text)
                 
                 print(f"Extracted similarity score for {doc.id}: {similarity_score}")
                 print(f"Reasoning for {doc.id}: {reasoning}")
@@ -581,6 +1502,15 @@ Reasoning: [brief explanation focusing on semantic/contextual relationships, not
                 updated_count += 1
                 print(f"Successfully updated document {doc.id}")
                 
+                if not data.verbose:
+                    results.append({
+                        "id": doc.id,
+                        "similarity_score": similarity_score,
+                        "old_weight": current_weight,
+                        "new_weight": new_weight
+                    })
+                    continue
+                
                 # Track all scores and updates
                 all_scores.append({
                     "id": doc.id,
@@ -605,14 +1535,21 @@ Reasoning: [brief explanation focusing on semantic/contextual relationships, not
                 traceback.print_exc()
                 continue
         
-        return {
+        if updated_count:
+            invalidate_prefetch_buffers()
+        
+        response = {
             "message": f"Updated {updated_count} image weights",
             "query": query,
             "total_documents": len(docs),
             "skipped_no_caption": skipped_no_caption,
-            "updated_images": results,
-            "all_scores": all_scores  # Include all scores for debugging
+            "skipped_not_candidate": skipped_not_candidate,
+            "candidate_fallback": candidate_fallback,
+            "updated_images": results
         }
+        if data.verbose:
+            response["all_scores"] = all_scores  # Include all scores for debugging
+        return FastJSONResponse(content=response)
 
         
     except Exception as e:
@@ -620,6 +1557,207 @@ Reasoning: [brief explanation focusing on semantic/contextual relationships, not
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to update weights: {str(e)}")
 
+def parse_batch_similarity_response(similarity_text: str, num_queries: int):
+    """
+    Extract per-query scores and reasoning from a batch similarity response
+    ("Score 1: ...", "Reasoning 1: ...", ...). A single query may also be answered
+    in the unnumbered "Score: ..." format. Queries without a score default to 0;
+    raises ValueError if no score could be parsed at all.
+    """
+    scores = [0.0] * num_queries
+    reasonings = ["No reasoning provided"] * num_queries
+    
+    # Unnumbered entries ("Score: 0.8") are read as query 1 when there is only one query
+    index_pattern = r'(\d+)' if num_queries > 1 else r'(\d*)'
+    parsed = 0
+    for match in re.finditer(r'Score\s*' + index_pattern + r'\s*:\s*([0-9]*\.?[0-9]+)', similarity_text, re.IGNORECASE):
+        index = int(match.group(1) or 1) - 1
+        if 0 <= index < num_queries:
+            scores[index] = max(0.0, min(1.0, float(match.group(2))))
+            parsed += 1
+    if not parsed:
+        raise ValueError(f"No similarity scores found in response: {similarity_text[:200]!r}")
+    
+    for match in re.finditer(r'Reasoning\s*' + index_pattern + r'\s*:\s*(.+?)(?:\n|$)', similarity_text, re.IGNORECASE):
+        index = int(match.group(1) or 1) - 1
+        if 0 <= index < num_queries:
+            reasonings[index] = match.group(2).strip()
+    
+    return scores, reasonings
+
+@app.post("/update_weights_by_similarity_batch")
+async def update_weights_by_similarity_batch(data: BatchSimilarityRequest):
+    """
+    Batch variant of /update_weights_by_similarity for several queries at once
+    (e.g. topics from a therapy session).
+    
+    The catalog is streamed once, each combined description is resolved once, and every
+    memory is scored against all queries in a single Gemini call. Each document then gets
+    one combined weight update, written with batched Firestore commits.
+    Formula: new_weight = old_weight + sum(query_weight * similarity_score)
+    """
+    if not GEMINI_KEY:
+        raise HTTPException(status_code=500, detail="GEMINI_KEY not configured")
+    
+    query_weights = data.weights if data.weights is not None else [1.0] * len(data.queries)
+    if len(query_weights) != len(data.queries):
+        raise HTTPException(status_code=400, detail="weights must have the same length as queries")
+    
+    # Merge duplicate queries so each distinct query is only scored once
+    merged = {}
+    for query, query_weight in zip(data.queries, query_weights):
+        query = query.strip()
+        if not query:
+            continue
+        key = query.lower()
+        if key in merged:
+            merged[key] = (merged[key][0], merged[key][1] + query_weight)
+        else:
+            merged[key] = (query, query_weight)
+    if not merged:
+        raise HTTPException(status_code=400, detail="At least one non-empty query is required")
+    queries = [query for query, _ in merged.values()]
+    weights = [query_weight for _, query_weight in merged.values()]
+    
+    try:
+        media_ref = db.collection("media")
+        docs = list(media_ref.stream())
+        
+        print(f"Found {len(docs)} documents in media collection for {len(queries)} queries")
+        
+        if len(docs) == 0:
+            return {
+                "message": "No images found in the database",
+                "queries": queries,
+                "weights": weights,
+                "updated_images": []
+            }
+        
+        model = genai.GenerativeModel('gemini-2.5-flash')
+        
+        # Optionally preselect candidates with the search index (union over all queries)
+        candidate_ids = None
+        candidate_fallback = False
+        if data.candidate_limit:
+            ensure_catalog_indexes()
+            candidate_ids = set()
+            for query in queries:
+                _, ranked = search_index.search(query, limit=data.candidate_limit)
+                if not ranked:
+                    # A query with no shared words needs semantic scoring against every memory
+                    print(f"No keyword matches for query '{query}', scoring every memory")
+                    candidate_ids = None
+                    candidate_fallback = True
+                    break
+                candidate_ids.update(doc_id for doc_id, _ in ranked)
+            if candidate_ids is not None:
+                print(f"Preselected {len(candidate_ids)} candidates from the search index")
+        
+        query_list = "\n".join(f"Query {i+1}: {query}" for i, query in enumerate(queries))
+        response_format = "\n".join(
+            f"Score {i+1}: [number between 0 and 1]\nReasoning {i+1}: [brief explanation]"
+            for i in range(len(queries))
+        )
+        
+        results = []
+        weight_updates = []
+        skipped_no_caption = 0
+        skipped_not_candidate = 0
+        failed_documents = 0
+        
+        for doc in docs:
+            if candidate_ids is not None and doc.id not in candidate_ids:
+                skipped_not_candidate += 1
+                continue
+            
+            data_dict = doc.to_dict() or {}
+            caption = data_dict.get("caption", "") or data_dict.get("context", "")
+            if not caption:
+                skipped_no_caption += 1
+                continue
+            
+            current_weight = data_dict.get("weight", 1.0)
+            combined_context = await get_combined_description(
+                caption, data_dict.get("url", ""), doc.id, doc.reference, data_dict.get("filename", ""),
+                doc_data=data_dict
+            )
+            
+            prompt = f"""You are analyzing memory-related queries. Determine how semantically and contextually relevant an image is to EACH of the following memory queries, independently.
+
+{query_list}
+
+Image Context (Combined Description - User Context Prioritized):
+{combined_context}
+
+IMPORTANT: The combined description prioritizes the user-provided context. Use this full context to determine semantic similarity.
+
+{SIMILARITY_GUIDELINES}
+
+Rate the relevance of the image to each query on a scale of 0 to 1 based on SEMANTIC and CONTEXTUAL similarity, not word overlap.
+
+Respond in the following format, with one Score and Reasoning line per query:
+{response_format}"""
+            
+            try:
+                print(f"Calling Gemini API for document {doc.id} ({len(queries)} queries)...")
+                response = await asyncio.to_thread(model.generate_content, prompt)
+                similarity_text = response.text.strip()
+                scores, reasonings = parse_batch_similarity_response(similarity_text, len(queries))
+            except Exception as e:
+                print(f"Error processing document {doc.id}: {e}")
+                traceback.print_exc()
+                failed_documents += 1
+                continue
+            
+            weight_delta = sum(query_weight * score for query_weight, score in zip(weights, scores))
+            new_weight = current_weight + weight_delta
+            weight_updates.append((doc.reference, {"weight": new_weight}))
+            
+            if data.verbose:
+                results.append({
+                    "id": doc.id,
+                    "caption": caption,
+                    "combined_description": combined_context,
+                    "scores": [
+                        {"query": query, "similarity_score": score, "reasoning": reasoning}
+                        for query, score, reasoning in zip(queries, scores, reasonings)
+                    ],
+                    "weight_delta": weight_delta,
+                    "old_weight": current_weight,
+                    "new_weight": new_weight
+                })
+            else:
+                # Scores are listed in the same order as the response's "queries"
+                results.append({
+                    "id": doc.id,
+                    "scores": scores,
+                    "weight_delta": weight_delta,
+                    "old_weight": current_weight,
+                    "new_weight": new_weight
+                })
+        
+        updated_count = commit_in_batches(weight_updates)
+        print(f"Applied combined weight updates to {updated_count} documents")
+        if updated_count:
+            invalidate_prefetch_buffers()
+        
+        return FastJSONResponse(content={
+            "message": f"Updated {updated_count} image weights for {len(queries)} queries",
+            "queries": queries,
+            "weights": weights,
+            "total_documents": len(docs),
+            "skipped_no_caption": skipped_no_caption,
+            "skipped_not_candidate": skipped_not_candidate,
+            "candidate_fallback": candidate_fallback,
+            "failed_documents": failed_documents,
+            "updated_images": results
+        })
+    
+    except Exception as e:
+        print("Batch similarity update error:", e)
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Failed to update weights: {str(e)}")
+
 @app.put("/reset_weights")
 def reset_weights():
     """
@@ -639,6 +1777,7 @@ def reset_weights():
         for doc in docs:
             doc.reference.update({"weight": 1.0})
             updated_count += 1
+        invalidate_prefetch_buffers()
         
         return {
             "message": f"Successfully reset weights to 1.0 for {updated_count} documents",
@@ -650,10 +1789,13 @@ def reset_weights():
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to reset weights: {str(e)}")
 
+SURVEY_QUESTION_COUNT = 3
+
 @app.get("/generate_survey")
 async def generate_survey(
     limit: int = Query(default=10, ge=1, le=50, description="Maximum number of memories to use for survey generation"),
-    min_memories: int = Query(default=3, ge=1, description="Minimum number of memories required to generate a survey")
+    min_memories: int = Query(default=3, ge=1, description="Minimum number of memories required to generate a survey"),
+    use_llm_fallback: bool = Query(default=True, description="Fall back to Gemini generation when there aren't enough extracted facts")
 ):
     """
     Generate a memory recall survey based on uploaded photos with combined descriptions.
@@ -662,9 +1804,13 @@ async def generate_survey(
     The patient will NOT see the photos during the survey, so questions focus on general facts
     like "what breed is your dog?" or "what brand is your car?" rather than photo-specific details.
     
-    Requirements:
-    - At least 'min_memories' images must exist in the database
-    - All selected images must have combined descriptions (waits for them to be generated)
+    Questions are built locally from the fact table extracted at upload time (no model calls):
+    - Templates turn (subject, relation, value) facts into easy MCQs
+    - Distractors come from other facts of the same relation and category
+    - The least recently asked facts are used first, from at most 'limit' memories
+    
+    If fewer than 'min_memories' memories have facts (or not enough questions can be built),
+    the survey is generated by Gemini from combined descriptions unless use_llm_fallback=false.
     
     Returns a survey with only MCQ questions about (keeping them to ONLY easy difficulty, no medium or hard):
     - General knowledge about their possessions (e.g., "what breed is your dog?")
@@ -674,6 +1820,64 @@ async def generate_survey(
     
     Questions do NOT reference photos or images and test recall, not visual recognition.
     """
+    try:
+        ensure_fact_store()
+        ensure_catalog_indexes()
+        
+        if fact_store.memory_count() >= min_memories:
+            questions, fact_ids = fact_store.build_survey(SURVEY_QUESTION_COUNT, max_memories=limit)
+            if len(questions) == SURVEY_QUESTION_COUNT:
+                # Record when each fact was asked so the next survey rotates to other facts
+                from datetime import datetime
+                asked_at = datetime.utcnow().isoformat() + "Z"
+                fact_store.mark_asked(fact_ids, asked_at)
+                facts_ref = db.collection("facts")
+                try:
+                    commit_in_batches((facts_ref.document(fact_id), {"last_asked_at": asked_at}) for fact_id in fact_ids)
+                except NotFound as stale_error:
+                    # backfill.py deleted some of these facts after they were loaded. The questions
+                    # are still valid for this survey; reload the table before building the next one.
+                    print(f"Warning: Facts changed since they were loaded ({stale_error}); reloading before the next survey")
+                    invalidate_fact_store()
+                
+                return {
+                    "survey": questions,
+                    "total_questions": len(questions),
+                    "memories_used": len({memory_id for question in questions for memory_id in question["related_memory_ids"]}),
+                    "total_memories_available": fact_store.memory_count(),
+                    "memories_without_descriptions": search_index.count_without_description(),
+                    "source": "facts"
+                }
+        
+        if not use_llm_fallback:
+            return JSONResponse(
+                status_code=202,  # Accepted but not ready
+                content={
+                    "status": "waiting",
+                    "message": "Not enough extracted facts to build a survey yet.",
+                    "memories_with_facts": fact_store.memory_count(),
+                    "total_facts": len(fact_store),
+                    "required": min_memories,
+                    "hint": "Facts are extracted automatically when images are uploaded. Please wait a moment and try again."
+                }
+            )
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        # Fact-based generation is an optimization; fall through to the LLM path on failure
+        print("Fact-based survey generation error:", e)
+        traceback.print_exc()
+        if not use_llm_fallback:
+            raise HTTPException(status_code=500, detail=f"Failed to generate survey: {str(e)}")
+    
+    return await generate_survey_with_llm(limit, min_memories)
+
+async def generate_survey_with_llm(limit: int, min_memories: int):
+    """
+    Fallback survey generation: send up to 'limit' combined descriptions to Gemini and
+    validate the 3 easy MCQs it returns. Requires at least 'min_memories' described images.
+    """
     if not GEMINI_KEY:
         raise HTTPException(status_code=500, detail="GEMINI_KEY not configured")
     
@@ -884,7 +2088,8 @@ Important:
             "total_questions": len(survey_json),
             "memories_used": len(memories_to_use),
             "total_memories_available": len(memories_with_descriptions),
-            "memories_without_descriptions": len(memories_without_descriptions)
+            "memories_without_descriptions": len(memories_without_descriptions),
+            "source": "llm"
         }
         
     except HTTPException:
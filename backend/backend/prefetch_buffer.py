@@ -0,0 +1,119 @@
+import asyncio
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set
+
+
+class PrefetchSession:
+    """
+    Per-client buffer of pre-sampled memories waiting to be delivered.
+
+    Items are appended in sampling order (related mode appends whole related sets, so
+    sets stay contiguous) and popped on delivery. `pending` holds ids pushed to a
+    connected client but not yet shown, and `discarded` collects ids delivered while a
+    refill was running, so the refill never re-adds them.
+    """
+
+    def __init__(self, session_id: str, related: bool = False, set_size: int = 1):
+        self.session_id = session_id
+        self.related = related
+        self.set_size = set_size
+        self.generation: Optional[int] = None
+        self.buffer = deque()
+        self.pending: Set[str] = set()
+        self.discarded: Set[str] = set()
+        self.lock = asyncio.Lock()
+        self.refill_task: Optional[asyncio.Task] = None
+        self.connections = 0
+        self.last_used = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def samples_like(self, related: bool, set_size: int) -> bool:
+        """Whether items sampled with these settings fit this session's buffer (set size only matters for related sets)."""
+        return related == self.related and (not related or set_size == self.set_size)
+
+    def configure(self, related: bool, set_size: int) -> bool:
+        """Record the requested mode and set size; clears the buffer (returns True) if the sampling mode changed."""
+        changed = not self.samples_like(related, set_size)
+        self.related = related
+        self.set_size = set_size
+        if changed:
+            self.clear()
+        return changed
+
+    def clear(self):
+        self.buffer.clear()
+        self.generation = None
+
+    def buffered_ids(self) -> Set[str]:
+        return {item["id"] for item in self.buffer}
+
+    def extend(self, items: Iterable[dict], generation: int):
+        """Append refill results sampled at `generation`, skipping ids delivered meanwhile."""
+        if self.generation != generation:
+            self.buffer.clear()
+            self.generation = generation
+        held = self.buffered_ids() | self.pending
+        for item in items:
+            if item["id"] not in held and item["id"] not in self.discarded:
+                self.buffer.append(item)
+                held.add(item["id"])
+
+    def take(self, count: int) -> List[dict]:
+        return [self.buffer.popleft() for _ in range(min(count, len(self.buffer)))]
+
+    def discard(self, ids: Iterable[str]):
+        """Drop memories delivered elsewhere from this buffer."""
+        ids = set(ids)
+        if not ids:
+            return
+        self.discarded |= ids
+        if any(item["id"] in ids for item in self.buffer):
+            self.buffer = deque(item for item in self.buffer if item["id"] not in ids)
+
+
+class PrefetchRegistry:
+    """Prefetch sessions by id; sessions idle longer than `ttl` seconds (with no open connection) expire."""
+
+    def __init__(self, ttl: float = 1800.0):
+        self.ttl = ttl
+        self._sessions: Dict[str, PrefetchSession] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __iter__(self):
+        return iter(list(self._sessions.values()))
+
+    def get(self, session_id: str) -> PrefetchSession:
+        self.expire()
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = PrefetchSession(session_id)
+            self._sessions[session_id] = session
+        session.touch()
+        return session
+
+    def expire(self) -> List[PrefetchSession]:
+        """Remove idle sessions, cancelling their refills. Returns the removed sessions."""
+        cutoff = time.monotonic() - self.ttl
+        expired = [
+            session for session in self._sessions.values()
+            if session.last_used < cutoff and not session.connections
+        ]
+        for session in expired:
+            del self._sessions[session.session_id]
+            if session.refill_task and not session.refill_task.done():
+                session.refill_task.cancel()
+        return expired
+
+    def clear(self):
+        for session in list(self._sessions.values()):
+            if session.refill_task and not session.refill_task.done():
+                session.refill_task.cancel()
+        self._sessions = {}
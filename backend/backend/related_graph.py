@@ -0,0 +1,89 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+class RelatedGraph:
+    """
+    Sparse k-nearest-neighbor graph linking related memories.
+
+    Each memory keeps at most `max_neighbors` (id, score) edges sorted by score.
+    Nodes are linked incrementally: when a memory is (re)described, its own neighbor
+    list is replaced and it is offered to the lists of its own top neighbors that are
+    already linked, so each update touches at most 2 * max_neighbors other lists and no
+    full rebuild is ever needed. Callers persist the lists of the nodes returned as changed.
+    """
+
+    def __init__(self, max_neighbors: int = 10):
+        self.max_neighbors = max_neighbors
+        self.is_built = False
+        self._lock = threading.RLock()
+        self._neighbors: Dict[str, List[Tuple[str, float]]] = {}
+        # Reverse edges: doc_id -> ids of nodes whose neighbor lists contain doc_id
+        self._referrers: Dict[str, Set[str]] = {}
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._neighbors
+
+    def neighbors(self, doc_id: str, k: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Return up to k (id, score) neighbors of a memory, best first."""
+        edges = self._neighbors.get(doc_id, [])
+        return list(edges if k is None else edges[:k])
+
+    def load_node(self, doc_id: str, edges: Iterable[Tuple[str, float]]):
+        """Restore a node's persisted neighbor list without touching other nodes."""
+        with self._lock:
+            self._set_edges(doc_id, sorted(edges, key=lambda edge: -edge[1])[:self.max_neighbors])
+
+    def update_node(self, doc_id: str, candidates: Iterable[Tuple[str, float]]) -> Set[str]:
+        """
+        Link a memory to its scored candidates.
+        Returns the ids of every node whose neighbor list changed (including doc_id).
+        """
+        candidates = [(other, score) for other, score in candidates if other != doc_id and score > 0]
+        candidates.sort(key=lambda edge: -edge[1])
+        changed = {doc_id}
+
+        scores = dict(candidates)
+
+        with self._lock:
+            # Re-score edges already pointing at this node, dropping those no longer relevant
+            for referrer in list(self._referrers.get(doc_id, ())):
+                current = self._neighbors.get(referrer, [])
+                edges = [edge for edge in current if edge[0] != doc_id]
+                if referrer in scores:
+                    edges.append((doc_id, scores[referrer]))
+                    edges.sort(key=lambda edge: -edge[1])
+                if edges != current:
+                    self._set_edges(referrer, edges)
+                    changed.add(referrer)
+
+            neighbors = candidates[:self.max_neighbors]
+            self._set_edges(doc_id, neighbors)
+
+            for other, score in neighbors:
+                if self._offer(other, doc_id, score):
+                    changed.add(other)
+
+        return changed
+
+    def _offer(self, doc_id: str, candidate: str, score: float) -> bool:
+        # Unlinked nodes get their full list when they are linked themselves
+        if doc_id not in self._neighbors:
+            return False
+        edges = self._neighbors[doc_id]
+        if len(edges) >= self.max_neighbors and score <= edges[-1][1]:
+            return False
+        edges = [edge for edge in edges if edge[0] != candidate]
+        edges.append((candidate, score))
+        edges.sort(key=lambda edge: -edge[1])
+        self._set_edges(doc_id, edges[:self.max_neighbors])
+        return True
+
+    def _set_edges(self, doc_id: str, edges: List[Tuple[str, float]]):
+        for other, _ in self._neighbors.get(doc_id, []):
+            referrers = self._referrers.get(other)
+            if referrers is not None:
+                referrers.discard(doc_id)
+        self._neighbors[doc_id] = edges
+        for other, _ in edges:
+            self._referrers.setdefault(other, set()).add(doc_id)
@@ -0,0 +1,187 @@
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Common English words that carry no meaning for memory lookups
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have",
+    "in", "is", "it", "its", "of", "on", "or", "that", "the", "their", "this", "to",
+    "was", "were", "with", "my", "our", "your", "his", "her", "they", "them",
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase a string and split it into searchable terms, dropping stopwords."""
+    if not text:
+        return []
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class SearchIndex:
+    """
+    In-process BM25 inverted index over memory captions and combined descriptions.
+
+    Documents are added or replaced one at a time, so the index can be kept up to date
+    incrementally as memories are uploaded and their descriptions change. Display fields
+    for each memory are kept alongside the postings so search results never need to
+    go back to Firestore.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.is_built = False
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._documents: Dict[str, dict] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_lengths
+
+    def add_document(self, doc_id: str, caption: str, combined_description: str = "", fields: Optional[dict] = None):
+        """Index (or re-index) a memory from its caption and combined description."""
+        # The caption usually appears verbatim in the combined description, so only
+        # index it separately when it adds something new.
+        text = combined_description or ""
+        if caption and caption not in text:
+            text = f"{caption} {text}"
+        terms = Counter(tokenize(text))
+
+        with self._lock:
+            self._remove_postings(doc_id)
+            for term, frequency in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = frequency
+            length = sum(terms.values())
+            self._doc_terms[doc_id] = terms
+            self._doc_lengths[doc_id] = length
+            self._total_length += length
+
+            document = dict(self._documents.get(doc_id, {}))
+            document.update(fields or {})
+            document.update({
+                "id": doc_id,
+                "caption": caption,
+                "combined_description": combined_description,
+            })
+            self._documents[doc_id] = document
+
+    def remove_document(self, doc_id: str):
+        """Drop a memory from the index."""
+        with self._lock:
+            self._remove_postings(doc_id)
+            self._documents.pop(doc_id, None)
+
+    def get_document(self, doc_id: str) -> Optional[dict]:
+        """Return the stored display fields for a memory, if it is indexed."""
+        document = self._documents.get(doc_id)
+        return dict(document) if document is not None else None
+
+    def count_without_description(self) -> int:
+        """Return how many indexed memories have no combined description yet."""
+        with self._lock:
+            return sum(
+                1 for document in self._documents.values()
+                if not (document.get("combined_description") or "").strip()
+            )
+
+    def get_terms(self, doc_id: str) -> Counter:
+        """Return the term frequencies indexed for a memory."""
+        return Counter(self._doc_terms.get(doc_id, {}))
+
+    def idf(self, term: str) -> float:
+        """BM25 inverse document frequency for a term (always non-negative)."""
+        document_frequency = len(self._postings.get(term, {}))
+        num_docs = len(self._doc_lengths)
+        return math.log(1 + (num_docs - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def score(self, query: str) -> Dict[str, float]:
+        """Return the BM25 score of every memory matching at least one query term."""
+        query_terms = set(tokenize(query))
+        scores: Dict[str, float] = {}
+
+        with self._lock:
+            if not self._doc_lengths:
+                return scores
+            avg_length = self._total_length / len(self._doc_lengths) or 1.0
+
+            for term in query_terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = self.idf(term)
+                for doc_id, frequency in postings.items():
+                    length_norm = 1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length
+                    term_score = idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + term_score
+
+        return scores
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[int, List[Tuple[str, float]]]:
+        """
+        Rank memories against a free-text query.
+        Returns the total number of matches and the requested page of (doc_id, score) pairs.
+        """
+        scores = self.score(query)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return len(ranked), ranked[offset:offset + limit]
+
+    def similar_documents(self, doc_id: str, limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Rank other memories by TF-IDF cosine similarity to an indexed memory.
+        Only memories sharing at least one term are considered, so the cost is
+        proportional to the matching postings rather than the whole catalog.
+        """
+        with self._lock:
+            terms = self._doc_terms.get(doc_id)
+            if not terms:
+                return []
+
+            idf_cache: Dict[str, float] = {}
+
+            def idf(term: str) -> float:
+                if term not in idf_cache:
+                    idf_cache[term] = self.idf(term)
+                return idf_cache[term]
+
+            def norm(terms: Counter) -> float:
+                return math.sqrt(sum((frequency * idf(term)) ** 2 for term, frequency in terms.items()))
+
+            dots: Dict[str, float] = {}
+            for term, frequency in terms.items():
+                weight = frequency * idf(term) ** 2
+                for other, other_frequency in self._postings.get(term, {}).items():
+                    if other != doc_id:
+                        dots[other] = dots.get(other, 0.0) + weight * other_frequency
+
+            doc_norm = norm(terms)
+            similarities = []
+            for other, dot in dots.items():
+                denominator = doc_norm * norm(self._doc_terms[other])
+                if denominator > 0:
+                    similarities.append((other, dot / denominator))
+
+        similarities.sort(key=lambda item: (-item[1], item[0]))
+        return similarities if limit is None else similarities[:limit]
+
+    def _remove_postings(self, doc_id: str):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id, 0)